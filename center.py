@@ -6,9 +6,11 @@ import click
 from wearebeautiful.process import center_mesh
 
 @click.command()
+@click.option("--rotate", "-r", nargs=3, type=float, default=None, help="Also rotate around the x, y and z axes, in degrees")
+@click.option("--scale", "-s", type=float, default=None, help="Also scale by this factor")
 @click.argument("filename", nargs=1)
-def center(filename):
-    center_mesh(filename)
+def center(rotate, scale, filename):
+    center_mesh(filename, rotate, scale)
 
 
 def usage(command):
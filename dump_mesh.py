@@ -5,6 +5,7 @@ import os
 from time import time
 import numpy as np
 from wearebeautiful.utils import get_fast_bbox
+from wearebeautiful.mesh_cache import load_mesh
 
 import pymesh
 import click
@@ -13,7 +14,7 @@ import click
 @click.argument("src_file", nargs=1)
 def invert(src_file):
 
-    mesh = pymesh.meshio.load_mesh(src_file);
+    mesh = load_mesh(src_file);
     bbox = get_fast_bbox(mesh)
 
     print("model %s" % src_file)
@@ -33,6 +33,7 @@ default_opts = {
     'solid' : False,
     'no_code' : False,
     'no_url' : False,
+    'vector_labels' : False,
 }
 @click.command()
 @click.argument("code", nargs=1)
@@ -69,6 +70,7 @@ default_opts = {
 @click.option('--solid', '-s', is_flag=True, default=default_opts['solid'])
 @click.option('--no-code', '-n', is_flag=True, default=default_opts['no_code'])
 @click.option('--no-url', '-n', is_flag=True, default=default_opts['no_url'])
+@click.option('--vector-labels', '-vl', is_flag=True, default=default_opts['vector_labels'])
 def solid(code, src_file, dest_file, **opts):
     make_solid(code, src_file, dest_file, opts)
 
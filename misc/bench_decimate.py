@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the QEM decimator on a bumpy grid mesh of scan size: the time per
+removed face, the number of rounds and how far the result is from the surface.
+"""
+import sys
+import os
+from time import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pymesh
+import click
+from wearebeautiful.decimate import QEMDecimator
+
+
+def surface_height(xs, ys):
+    return 3.0 * np.sin(xs / 7.0) * np.cos(ys / 5.0)
+
+
+def make_bumpy_grid_mesh(width, height):
+    xs, ys = np.meshgrid(np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64))
+    zs = surface_height(xs, ys) + 0.01 * np.random.RandomState(0).rand(height, width)
+    vertices = np.column_stack((xs.ravel(), ys.ravel(), zs.ravel()))
+
+    idx = np.arange(width * height).reshape(height, width)
+    v0 = idx[:-1, :-1].ravel()
+    v1 = idx[:-1, 1:].ravel()
+    v2 = idx[1:, :-1].ravel()
+    v3 = idx[1:, 1:].ravel()
+    faces = np.concatenate((np.column_stack((v0, v1, v3)), np.column_stack((v0, v3, v2))))
+
+    return pymesh.form_mesh(vertices, faces)
+
+
+@click.command()
+@click.option('--width', '-w', default=1000, type=int, help='Number of grid vertices along x')
+@click.option('--height', '-h', default=1000, type=int, help='Number of grid vertices along y')
+@click.option('--target', '-t', default=100000, type=int, help='Number of faces to decimate to')
+def bench(width, height, target):
+
+    mesh = make_bumpy_grid_mesh(width, height)
+    print("mesh: %s vertices, %s faces\n" % ("{:,}".format(mesh.num_vertices), "{:,}".format(mesh.num_faces)))
+
+    t0 = time()
+    decimator = QEMDecimator(mesh.vertices, mesh.faces)
+    setup_t = time() - t0
+
+    t0 = time()
+    decimator.run(target)
+    run_t = time() - t0
+
+    result = decimator.mesh()
+    removed = mesh.num_faces - result.num_faces
+    error = np.abs(result.vertices[:, 2] - surface_height(result.vertices[:, 0], result.vertices[:, 1])).max()
+
+    print("setup:   %8.2fs" % setup_t)
+    print("run:     %8.2fs in %d rounds, %.1fus per removed face" % (run_t, decimator.round, run_t / max(removed, 1) * 1e6))
+    print("result:  %s faces, max height error %.3f" % ("{:,}".format(result.num_faces), error))
+
+
+if __name__ == "__main__":
+    bench()
+    sys.exit(0)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the vectorized transform/bbox kernels in wearebeautiful.utils against
+the per-vertex python loops they replaced, on a multi-million vertex grid mesh.
+"""
+import sys
+import os
+from time import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pymesh
+import click
+from wearebeautiful.utils import get_fast_bbox, translate, scale, flip_mesh, make_3d, center_around_origin
+
+
+def make_grid_mesh(width, height):
+    xs, ys = np.meshgrid(np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64))
+    zs = np.sin(xs / 50.0) * np.cos(ys / 50.0) * 10.0
+    vertices = np.column_stack((xs.ravel(), ys.ravel(), zs.ravel()))
+
+    idx = np.arange(width * height).reshape(height, width)
+    v0 = idx[:-1, :-1].ravel()
+    v1 = idx[:-1, 1:].ravel()
+    v2 = idx[1:, :-1].ravel()
+    v3 = idx[1:, 1:].ravel()
+    faces = np.concatenate((np.column_stack((v0, v1, v3)), np.column_stack((v0, v3, v2))))
+
+    return pymesh.form_mesh(vertices, faces)
+
+
+def legacy_get_fast_bbox(mesh):
+
+    bbox = [[100000,100000,100000], [0,0,0]]
+    for vertex in mesh.vertices:
+        for i in range(3):
+            if vertex[i] > bbox[1][i]:
+                bbox[1][i] = vertex[i]
+            if vertex[i] < bbox[0][i]:
+                bbox[0][i] = vertex[i]
+
+    return bbox
+
+
+def legacy_translate(mesh, translation_vector):
+    vertices = []
+    for vertex in mesh.vertices:
+        vertices.append((vertex[0] + translation_vector[1], vertex[1] + translation_vector[0], vertex[2] + translation_vector[2]))
+
+    return pymesh.form_mesh(vertices, mesh.faces, mesh.voxels)
+
+
+def legacy_scale(mesh, scale_factor):
+    vertices = []
+    for vertex in mesh.vertices:
+        vertices.append((vertex[0] * scale_factor[0], vertex[1] * scale_factor[1], vertex[2] * scale_factor[2]))
+
+    return pymesh.form_mesh(vertices, mesh.faces, mesh.voxels)
+
+
+def legacy_flip_mesh(mesh):
+    new_faces = []
+    for face in mesh.faces:
+        new_face = list(face)
+        new_face.reverse()
+        new_faces.append(new_face)
+
+    return pymesh.form_mesh(mesh.vertices, np.array(new_faces))
+
+
+def legacy_make_3d(mesh, offset):
+    vertices = [ (vertex[0], vertex[1], offset) for vertex in mesh.vertices]
+    return pymesh.form_mesh(vertices, mesh.faces, mesh.voxels)
+
+
+def timed(func, *args):
+    t0 = time()
+    result = func(*args)
+    return result, time() - t0
+
+
+@click.command()
+@click.option('--width', '-w', default=2000, type=int, help='Number of grid vertices along x')
+@click.option('--height', '-h', default=1500, type=int, help='Number of grid vertices along y')
+def bench(width, height):
+
+    mesh = make_grid_mesh(width, height)
+    print("mesh: %s vertices, %s faces\n" % ("{:,}".format(mesh.num_vertices), "{:,}".format(mesh.num_faces)))
+
+    cases = [
+        ("get_fast_bbox", legacy_get_fast_bbox, get_fast_bbox, (mesh,)),
+        ("translate", legacy_translate, translate, (mesh, (1.0, 2.0, 3.0))),
+        ("scale", legacy_scale, scale, (mesh, (1.5, 1.5, 1.5))),
+        ("flip_mesh", legacy_flip_mesh, flip_mesh, (mesh,)),
+        ("make_3d", legacy_make_3d, make_3d, (mesh, -5.0)),
+    ]
+
+    print("%-16s %10s %10s %9s" % ("kernel", "loop (s)", "numpy (s)", "speedup"))
+    for name, legacy, fast, args in cases:
+        old_result, old_t = timed(legacy, *args)
+        new_result, new_t = timed(fast, *args)
+        if name == "get_fast_bbox":
+            assert np.allclose(old_result, new_result)
+        else:
+            assert np.allclose(old_result.vertices, new_result.vertices)
+            assert np.array_equal(old_result.faces, new_result.faces)
+        print("%-16s %10.3f %10.3f %8.1fx" % (name, old_t, new_t, old_t / max(new_t, 1e-9)))
+
+    centered, t = timed(center_around_origin, mesh)
+    print("\ncenter_around_origin: %.3fs" % t)
+
+
+if __name__ == "__main__":
+    bench()
+    sys.exit(0)
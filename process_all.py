@@ -5,15 +5,20 @@ import shutil
 import click
 from wearebeautiful.solid import make_solid
 from make_solid import default_opts
-from wearebeautiful.scale import scale_mesh
+from wearebeautiful.scale import scale_mesh, DOWNSAMPLE_JOBS
 from wearebeautiful.manifest import validate_manifest, make_code
-from wearebeautiful.process import process_surface, get_dest_paths
+from wearebeautiful.process import process_surface, get_dest_paths, get_surface_path
+from wearebeautiful.jobs import run_jobs, estimate_memory, default_memory_budget
+from wearebeautiful.archive import ARCHIVE_CODECS
 import config
 
 
 @click.command()
 @click.option('--force', '-f', is_flag=True, default=False)
-def process_all(force):
+@click.option('--jobs', '-j', default=1, type=int, help='Number of models to process at the same time')
+@click.option('--memory', '-m', default=None, type=float, help='Memory budget in GB for --jobs (default: 75% of the available memory)')
+@click.option('--codec', '-c', type=click.Choice(sorted(ARCHIVE_CODECS)), default="gzip", help='Compression for the git archive copies')
+def process_all(force, jobs, memory, codec):
 
     if not os.path.isdir(config.SURFACE_DIR):
         print("surface dir %s does not exist or is not accessible." % config.SURFACE_DIR)
@@ -23,6 +28,7 @@ def process_all(force):
         print("model dir %s does not exist or is not accessible." % config.MODEL_DIR)
         sys.exit(-1)
 
+    models = []
     for dir in sorted(os.listdir(config.SURFACE_DIR)):
         if dir in ['.','..']:
             continue
@@ -34,11 +40,41 @@ def process_all(force):
         if len(dir) != 6 or not dir.isdigit():
             continue
 
-        process_human_model_dir(dir, full_path, force)
+        models.extend(find_human_models(dir, full_path))
+
+    if jobs <= 1:
+        for id, code, version in models:
+            if not process_surface(id, code, version, force, DOWNSAMPLE_JOBS, codec):
+                sys.exit(-1)
+        return
+
+    if memory:
+        memory_budget = int(memory * 1024 * 1024 * 1024)
+    else:
+        memory_budget = default_memory_budget()
+    print("process %d models, %d at a time in %sMb of memory" % (len(models), jobs, f'{memory_budget // (1024 * 1024):,}'))
+
+    # the models run in parallel, so each of them runs its steps one at a time
+    tasks = []
+    for id, code, version in models:
+        path = get_surface_path(id, code, version)
+        mem = estimate_memory([ os.path.join(path, "surface.stl"), os.path.join(path, "solid.stl") ])
+        tasks.append(("%s-%s-%d" % (id, code, version), mem, (id, code, version, force, 1, codec, 1)))
+
+    failed = run_jobs(jobs, process_surface, tasks, memory_budget)
+    if failed:
+        print("%d models failed:" % len(failed))
+        for name in failed:
+            print("  %s" % name)
+        sys.exit(-1)
 
 
-def process_human_model_dir(id, human_model_dir, force):
+def find_human_models(id, human_model_dir):
+    """
+       returns (id, code, version) for each model directory of a human model
+    """
 
+    models = []
     for dir in sorted(os.listdir(human_model_dir)):
         if dir in ['.','..']:
             continue
@@ -59,9 +95,9 @@ def process_human_model_dir(id, human_model_dir, force):
             except ValueError:
                 continue
 
-        full_path = os.path.join(human_model_dir, dir)
-        if not process_surface(id, code, version, force):
-            sys.exit(-1)
+        models.append((id, code, version))
+
+    return models
 
 
 def usage(command):
@@ -4,14 +4,17 @@ import json
 import shutil
 import click
 from wearebeautiful.process import process_surface
+from wearebeautiful.scale import DOWNSAMPLE_JOBS
+from wearebeautiful.archive import ARCHIVE_CODECS
 
 @click.command()
 @click.option("-f", "--force", is_flag=True, default=False)
+@click.option("-c", "--codec", type=click.Choice(sorted(ARCHIVE_CODECS)), default="gzip", help="Compression for the git archive copies")
 @click.argument("id", nargs=1)
 @click.argument("code", nargs=1)
 @click.argument("version", nargs=1)
-def process(force, id, code, version):
-    process_surface(id, code, int(version), force)
+def process(force, codec, id, code, version):
+    process_surface(id, code, int(version), force, DOWNSAMPLE_JOBS, codec)
 
 
 def usage(command):
@@ -5,33 +5,18 @@ Dumbass mesh scale function
 """
 import sys
 import os
-from time import time
-import numpy as np
-
-import pymesh
 import click
-
-def resize_mesh(mesh, scale):
-    new_vertices = []
-    for vertex in mesh.vertices:
-        new_vertex = []
-        for v in list(vertex):
-            new_vertex.append(v * scale)
-
-        new_vertices.append(new_vertex)
-
-    return pymesh.form_mesh(np.array(new_vertices), mesh.faces)
+from wearebeautiful.process import transform_mesh
 
 
 @click.command()
+@click.option("--rotate", "-r", nargs=3, type=float, default=None, help="Also rotate around the x, y and z axes, in degrees")
+@click.option("--center", "-c", is_flag=True, default=False, help="Also center the mesh around the origin")
 @click.argument("scale", nargs=1, type=float)
 @click.argument("in_file", nargs=1)
 @click.argument("out_file", nargs=1)
-def resize(scale, in_file, out_file):
-
-    mesh = pymesh.meshio.load_mesh(in_file)
-    mesh = resize_mesh(mesh, scale)
-    pymesh.meshio.save_mesh(out_file, mesh)
+def resize(rotate, center, scale, in_file, out_file):
+    transform_mesh(in_file, rotate, scale, center, out_file)
 
 
 def usage(command):
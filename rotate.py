@@ -10,8 +10,10 @@ from wearebeautiful.process import rotate_mesh
 @click.argument("rot_x", nargs=1, type=float)
 @click.argument("rot_y", nargs=1, type=float)
 @click.argument("rot_z", nargs=1, type=float)
-def rotate(filename, rot_x, rot_y, rot_z):
-    rotate_mesh(filename, rot_x, rot_y, rot_z)
+@click.option("--scale", "-s", type=float, default=None, help="Also scale by this factor")
+@click.option("--center", "-c", is_flag=True, default=False, help="Also center the mesh around the origin")
+def rotate(filename, rot_x, rot_y, rot_z, scale, center):
+    rotate_mesh(filename, rot_x, rot_y, rot_z, scale, center)
 
 
 def usage(command):
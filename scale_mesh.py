@@ -1,16 +1,17 @@
 #!/usr/bin/env python3
 
-from wearebeautiful.scale import scale_mesh
+from wearebeautiful.scale import scale_mesh, LOD_ENGINES
 import click
 
 @click.command()
 @click.option('--cleanup', default=False, help='Clean the mesh before scaling')
 @click.option('--invert/--no-invert', default=False, help='Flip the normals on the STL file')
+@click.option('--engine', '-e', type=click.Choice(LOD_ENGINES), default="remesh", help='Remesh to the segment len or decimate to the same number of faces')
 @click.argument("len", nargs=1, type=float)
 @click.argument("in_file", nargs=1)
 @click.argument("out_file", nargs=1)
-def scale(invert, len, in_file, out_file):
-    scale_mesh(invert, len, in_file, out_file)
+def scale(invert, engine, len, in_file, out_file):
+    scale_mesh(invert, len, in_file, out_file, engine)
 
 
 def usage(command):
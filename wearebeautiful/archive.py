@@ -0,0 +1,94 @@
+import os
+import gzip
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ARCHIVE_CODECS = {
+    'gzip' : ".gz",
+    'zstd' : ".zst",
+    'brotli' : ".br",
+}
+ARCHIVE_CHUNK_SIZE = 4 * 1024 * 1024   # MB
+ARCHIVE_THREADS = 4
+# Web delivery levels: the copies are made on every build, the top levels (zstd 19,
+# brotli 11) take many times as long for a few percent smaller files.
+ARCHIVE_GZIP_LEVEL = 6
+ARCHIVE_ZSTD_LEVEL = 10
+ARCHIVE_BROTLI_LEVEL = 5
+
+
+class BrotliWriter(object):
+    """ A file like writer for the brotli streaming compressor. """
+
+    def __init__(self, f):
+        self.f = f
+        self.compressor = brotli.Compressor(quality=ARCHIVE_BROTLI_LEVEL)
+
+    def write(self, data):
+        self.f.write(self.compressor.process(data))
+
+    def close(self):
+        self.f.write(self.compressor.finish())
+
+
+def codec_extension(codec):
+    return ARCHIVE_CODECS[codec]
+
+
+def check_codec(codec):
+    """
+       returns an error message if codec can't be used, None otherwise
+    """
+
+    if codec not in ARCHIVE_CODECS:
+        return "unknown codec '%s', use one of %s" % (codec, ", ".join(sorted(ARCHIVE_CODECS)))
+    if codec == 'zstd' and zstandard is None:
+        return "the zstd codec needs the zstandard module: pip3 install zstandard"
+    if codec == 'brotli' and brotli is None:
+        return "the brotli codec needs the brotli module: pip3 install brotli"
+
+    return None
+
+
+def compressor(codec, f, name, mtime):
+    if codec == 'gzip':
+        # like the gzip command line tool, record the name and mtime of the uncompressed
+        # file, so the same source always gives the same archive copy
+        return gzip.GzipFile(filename=name, mode="wb", fileobj=f, compresslevel=ARCHIVE_GZIP_LEVEL, mtime=mtime)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL).stream_writer(f, closefd=False)
+    if codec == 'brotli':
+        return BrotliWriter(f)
+
+    raise ValueError(check_codec(codec))
+
+
+def copy_and_compress(src, plain_dest, comp_dest, codec="gzip"):
+    """
+       Read src once and write a plain copy to plain_dest (unless it is None) and a
+       compressed copy to comp_dest at the same time.
+    """
+
+    plain = None
+    try:
+        if plain_dest:
+            plain = open(plain_dest, "wb")
+        with open(src, "rb") as f_in, open(comp_dest, "wb") as f_comp:
+            comp = compressor(codec, f_comp, os.path.basename(src if plain_dest is None else plain_dest),
+                              os.path.getmtime(src))
+            for chunk in iter(lambda: f_in.read(ARCHIVE_CHUNK_SIZE), b""):
+                if plain:
+                    plain.write(chunk)
+                comp.write(chunk)
+            comp.close()
+    finally:
+        if plain:
+            plain.close()
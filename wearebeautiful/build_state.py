@@ -0,0 +1,149 @@
+import os
+import ast
+import json
+import hashlib
+import tempfile
+
+# The build state is kept next to the outputs. It must not end in .json, create_db reads
+# every .json file in the model dirs as a manifest.
+BUILD_STATE_FILE = ".%s.build_state"
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+tool_hashes = {}
+
+
+def tool_modules(roots):
+    """
+       Follow the imports of the modules in roots through the wearebeautiful package,
+       including the ones made inside functions.
+
+       returns the sorted names of the package modules that roots depend on
+    """
+
+    modules = set()
+    todo = list(roots)
+    while todo:
+        name = todo.pop()
+        filename = os.path.join(PACKAGE_DIR, name + ".py")
+        if name in modules or not os.path.exists(filename):
+            continue
+
+        modules.add(name)
+        with open(filename, "r") as f:
+            tree = ast.parse(f.read(), filename)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and node.module == "wearebeautiful":
+                todo.extend([ alias.name for alias in node.names ])
+            elif isinstance(node, ast.ImportFrom) and node.module and node.module.startswith("wearebeautiful."):
+                todo.append(node.module.split(".")[1])
+            elif isinstance(node, ast.Import):
+                todo.extend([ alias.name.split(".")[1] for alias in node.names
+                              if alias.name.startswith("wearebeautiful.") ])
+
+    return sorted(modules)
+
+
+def hash_tools(roots):
+    """
+       returns the sha256 of the sources of roots and the package modules they import,
+       computed once per run
+    """
+
+    key = tuple(sorted(roots))
+    if key not in tool_hashes:
+        h = hashlib.sha256()
+        for name in tool_modules(roots):
+            h.update(name.encode('utf-8'))
+            with open(os.path.join(PACKAGE_DIR, name + ".py"), "rb") as f:
+                h.update(f.read())
+        tool_hashes[key] = h.hexdigest()
+
+    return tool_hashes[key]
+
+
+class BuildState(object):
+    """
+       Records what every output of a model was built from: the hash of each input file,
+       the options and the hash of the sources of the modules that made it. An output is
+       up to date if it exists and all of those are unchanged. Outputs that are plain
+       copies are made by no module, so changing the code never rebuilds them.
+
+       The hashes of the inputs are cached along with their size and mtime, so an input
+       that wasn't touched is not read again.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename, "r") as f:
+                state = json.loads(f.read())
+            self.inputs = state['inputs']
+            self.outputs = state['outputs']
+        except (IOError, ValueError, KeyError):
+            self.inputs = {}
+            self.outputs = {}
+
+
+    def hash_input(self, filename):
+        st = os.stat(filename)
+        cached = self.inputs.get(filename)
+        if cached and cached['size'] == st.st_size and cached['mtime'] == st.st_mtime_ns:
+            return cached['hash']
+
+        h = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+
+        self.inputs[filename] = { 'size' : st.st_size, 'mtime' : st.st_mtime_ns, 'hash' : h.hexdigest() }
+        return self.inputs[filename]['hash']
+
+
+    def make_record(self, inputs, opts, tools):
+        record = {
+            'inputs' : { os.path.basename(f) : self.hash_input(f) for f in inputs },
+            'opts' : json.loads(json.dumps(opts, sort_keys=True)),
+        }
+        if tools:
+            record['tools'] = hash_tools(tools)
+
+        return record
+
+
+    def is_current(self, output, inputs, opts, files, tools=()):
+        """
+           returns True if output was built from the same inputs with the same opts and
+           the same tool sources and all the files it consists of exist
+        """
+
+        if not all([ os.path.exists(f) for f in files ]):
+            return False
+
+        try:
+            return self.outputs.get(os.path.basename(output)) == self.make_record(inputs, opts, tools)
+        except OSError:
+            return False
+
+
+    def record(self, output, inputs, opts, tools=()):
+        """
+           Record that output was just built and save the state.
+        """
+
+        self.outputs[os.path.basename(output)] = self.make_record(inputs, opts, tools)
+        self.save()
+
+
+    def save(self):
+        dir = os.path.dirname(self.filename)
+        fd, temp_file = tempfile.mkstemp(dir=dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(json.dumps({ 'inputs' : self.inputs, 'outputs' : self.outputs }, indent=4, sort_keys=True))
+            os.replace(temp_file, self.filename)
+        except IOError as err:
+            print("cannot save build state %s: %s" % (self.filename, str(err)))
+            try:
+                os.unlink(temp_file)
+            except OSError:
+                pass
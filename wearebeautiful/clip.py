@@ -0,0 +1,223 @@
+import numpy as np
+import pymesh
+from wearebeautiful.extrude import find_boundary_edges, stitch_boundaries
+from wearebeautiful.triangulate import triangulate_loops
+from wearebeautiful import csg
+
+# vertices closer than this to a clipping plane are snapped onto it, so the cut never
+# creates slivers or near duplicate points that upset the cap triangulation
+CLIP_TOLERANCE = 1e-6
+
+# the slab that goes through a local boolean reaches this far past the cutter, so the
+# boolean never gets near the cut that the slab is stitched back along
+LOCAL_BOOLEAN_MARGIN = 1.0
+
+
+def clip_half_space(vertices, faces, axis, value, keep_greater):
+    """
+       Cut a mesh along the axis aligned plane vertices[:, axis] == value and keep the
+       half where the coordinate is greater (or smaller) than value. Faces that straddle
+       the plane are split, new vertices are shared between neighbouring faces so the
+       cut stays conforming. The cut is left open, see cap_plane.
+
+       returns vertices, faces arrays
+    """
+
+    sign = 1.0 if keep_greater else -1.0
+    dist = (vertices[:, axis] - value) * sign
+    near = (dist != 0.0) & (np.abs(dist) < CLIP_TOLERANCE)
+    if near.any():
+        vertices = vertices.copy()
+        vertices[near, axis] = value
+        dist[near] = 0.0
+    face_dist = dist[faces]
+
+    inside = face_dist.min(axis=1) >= 0.0
+    outside = face_dist.max(axis=1) <= 0.0
+    straddle = ~inside & ~outside
+    if not straddle.any():
+        return vertices, faces[inside]
+
+    cut = faces[straddle]
+    cut_inside = face_dist[straddle] >= 0.0
+    one_inside = cut_inside.sum(axis=1) == 1
+
+    # rotate each face so the odd vertex out (the only inside or the only outside one) comes first
+    odd = np.where(one_inside, np.argmax(cut_inside, axis=1), np.argmin(cut_inside, axis=1))
+    rows = np.arange(len(cut))[:, np.newaxis]
+    cut = cut[rows, (odd[:, np.newaxis] + np.arange(3)) % 3]
+    v0, v1, v2 = cut[:, 0], cut[:, 1], cut[:, 2]
+
+    # one new vertex per cut edge, keyed on the sorted vertex pair
+    edges = np.concatenate((np.column_stack((v0, v1)), np.column_stack((v0, v2))))
+    edges.sort(axis=1)
+    keys = (edges[:, 0].astype(np.int64) << 32) | edges[:, 1]
+    keys, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.ravel()
+    lo = keys >> 32
+    hi = keys & 0xffffffff
+
+    d_lo = dist[lo]
+    d_hi = dist[hi]
+    on_plane = d_hi == 0.0
+    new_idx = np.where(d_lo == 0.0, lo, np.where(on_plane, hi, -1))
+
+    crossing = new_idx == -1
+    t = d_lo[crossing] / (d_lo[crossing] - d_hi[crossing])
+    points = vertices[lo[crossing]] + t[:, np.newaxis] * (vertices[hi[crossing]] - vertices[lo[crossing]])
+    points[:, axis] = value
+    new_idx[crossing] = len(vertices) + np.arange(len(points))
+    vertices = np.concatenate((vertices, points))
+
+    p01 = new_idx[inverse[:len(cut)]]
+    p02 = new_idx[inverse[len(cut):]]
+
+    single = one_inside
+    double = ~one_inside
+    new_faces = np.concatenate((np.column_stack((v0[single], p01[single], p02[single])),
+                                np.column_stack((p01[double], v1[double], v2[double])),
+                                np.column_stack((p01[double], v2[double], p02[double]))))
+    degenerate = (new_faces[:, 0] == new_faces[:, 1]) | (new_faces[:, 1] == new_faces[:, 2]) | \
+                 (new_faces[:, 0] == new_faces[:, 2])
+
+    return vertices, np.concatenate((faces[inside], new_faces[~degenerate]))
+
+
+def cap_plane(vertices, faces, axis, value, keep_greater):
+    """
+       Close the open cut left by clip_half_space with a triangulated cap on the plane.
+       Only closed loops of boundary edges that lie on the plane are capped.
+
+       returns faces with the cap faces added
+    """
+
+    edges = find_boundary_edges(faces)
+    on_plane = (vertices[edges[:, 0], axis] == value) & (vertices[edges[:, 1], axis] == value)
+    edges = edges[on_plane]
+    if len(edges) == 0:
+        return faces
+
+    u, v = (axis + 1) % 3, (axis + 2) % 3
+    plane_vertices = vertices[:, [u, v, axis]]
+    loops = []
+    for loop in stitch_boundaries(edges.tolist(), plane_vertices):
+        if len(loop.edges) < 3 or loop.edges[-1][1] != loop.edges[0][0]:
+            print("clip: skipping an open cut on plane %s = %.3f" % ("xyz"[axis], value))
+            continue
+        loops.append(np.array([ edge[0] for edge in loop.edges ], dtype=np.int64))
+
+    if not loops:
+        return faces
+
+    points, cap = triangulate_loops([ plane_vertices[loop, :2] for loop in loops ])
+    cap = np.concatenate(loops)[cap]
+
+    # the triangles come out counter clockwise in (u, v), which faces along +axis. The cap
+    # has to face out of the half that was kept.
+    if keep_greater:
+        cap = cap[:, ::-1]
+
+    return np.concatenate((faces, cap))
+
+
+def clip_mesh_to_box(mesh, planes):
+    """
+       Clip a closed mesh with a list of axis aligned half spaces and cap each cut, so the
+       result is closed again. planes is a list of (axis, value, keep_greater) tuples.
+
+       returns the clipped mesh
+    """
+
+    vertices = np.asarray(mesh.vertices, dtype=np.float64)
+    faces = np.asarray(mesh.faces, dtype=np.int64)
+    for axis, value, keep_greater in planes:
+        vertices, faces = clip_half_space(vertices, faces, axis, value, keep_greater)
+        faces = cap_plane(vertices, faces, axis, value, keep_greater)
+
+    used, faces = np.unique(faces, return_inverse=True)
+    return pymesh.form_mesh(vertices[used], faces.reshape(-1, 3))
+
+
+def compact(vertices, faces):
+    used, faces = np.unique(faces, return_inverse=True)
+    return vertices[used], faces.reshape(-1, 3)
+
+
+def slab_plane(vertices, bbox, margin):
+    """
+       Pick the axis aligned plane that cuts the smallest slab (by vertex count) off a
+       mesh, while the slab still holds bbox grown by margin.
+
+       returns (axis, value, keep_greater) of the half space of the slab
+    """
+
+    candidates = []
+    for axis in range(3):
+        value = bbox[1][axis] + margin
+        candidates.append((np.count_nonzero(vertices[:, axis] < value), axis, value, False))
+        value = bbox[0][axis] - margin
+        candidates.append((np.count_nonzero(vertices[:, axis] > value), axis, value, True))
+
+    count, axis, value, keep_greater = min(candidates)
+    return axis, value, keep_greater
+
+
+def stitch_along_plane(a, b, axis, value):
+    """
+       Join two (vertices, faces) halves of a mesh that was cut along the plane
+       vertices[:, axis] == value. The faces that lie on the plane (the caps) are
+       dropped and the cut vertices the halves share are welded.
+
+       returns the joined mesh
+    """
+
+    vertices = np.concatenate((a[0], b[0]))
+    faces = np.concatenate((a[1], b[1] + len(a[0])))
+    faces = faces[~(vertices[faces, axis] == value).all(axis=1)]
+
+    on_plane = np.flatnonzero(vertices[:, axis] == value)
+    __, first, inverse = np.unique(vertices[on_plane], axis=0, return_index=True, return_inverse=True)
+    remap = np.arange(len(vertices))
+    remap[on_plane] = on_plane[first[inverse.ravel()]]
+
+    return pymesh.form_mesh(*compact(vertices, remap[faces]))
+
+
+def subtract_locally(mesh, cutters, engine="igl", debug=False):
+    """
+       Subtract the cutters (csg leaves) from a closed mesh one after the other, without
+       handing the whole mesh to the boolean engine. For each cutter the mesh is cut
+       along the plane that splits off the smallest slab that still holds the cutter.
+       Only the capped slab goes through the boolean. The cap is LOCAL_BOOLEAN_MARGIN
+       away from the cutter, so the boolean leaves it alone and the slab is stitched
+       back to the rest of the mesh along the cut.
+
+       returns the resulting mesh
+    """
+
+    for cutter in cutters:
+        vertices = np.asarray(mesh.vertices, dtype=np.float64)
+        faces = np.asarray(mesh.faces, dtype=np.int64)
+        axis, value, keep_greater = slab_plane(vertices, csg.bbox_of(cutter.mesh), LOCAL_BOOLEAN_MARGIN)
+
+        slab_vertices, slab_faces = clip_half_space(vertices, faces, axis, value, keep_greater)
+        slab_faces = cap_plane(slab_vertices, slab_faces, axis, value, keep_greater)
+        rest_vertices, rest_faces = clip_half_space(vertices, faces, axis, value, not keep_greater)
+
+        # an open slab can't go through the boolean and a slab that is all of the mesh
+        # gains nothing, subtract from the whole mesh then
+        if len(rest_faces) == 0 or len(find_boundary_edges(slab_faces)):
+            plan = csg.difference(cutter.name, csg.leaf("%s-mesh" % cutter.name, mesh), cutter)
+            mesh = csg.evaluate(plan, engine, debug)
+            continue
+
+        slab = pymesh.form_mesh(*compact(slab_vertices, slab_faces))
+        print("subtract %s from a slab of %s of %s faces" % (cutter.name, "{:,}".format(slab.num_faces),
+                                                          "{:,}".format(len(faces))))
+        plan = csg.difference(cutter.name, csg.leaf("%s-slab" % cutter.name, slab), cutter)
+        slab = csg.evaluate(plan, engine, debug)
+
+        mesh = stitch_along_plane((np.asarray(slab.vertices, dtype=np.float64), np.asarray(slab.faces, dtype=np.int64)),
+                                  (rest_vertices, rest_faces), axis, value)
+
+    return mesh
@@ -0,0 +1,153 @@
+import heapq
+from time import time
+import numpy as np
+import pymesh
+from wearebeautiful.utils import save_mesh
+
+# bboxes closer than this are treated as touching, which needs a real boolean
+BBOX_TOLERANCE = .001
+
+
+class CSGNode(object):
+    """
+       A node of a CSG expression tree. Leaves hold a mesh, inner nodes hold an operation
+       ("union" or "difference") and a list of operands.
+    """
+
+    def __init__(self, name, operation=None, operands=None, mesh=None):
+        self.name = name
+        self.operation = operation
+        self.operands = operands or []
+        self.mesh = mesh
+
+
+def leaf(name, mesh):
+    return CSGNode(name, mesh=mesh)
+
+
+def union(name, *operands):
+    return CSGNode(name, "union", list(operands))
+
+
+def difference(name, minuend, subtrahend):
+    return CSGNode(name, "difference", [minuend, subtrahend])
+
+
+def bbox_of(mesh):
+    return mesh.vertices.min(axis=0), mesh.vertices.max(axis=0)
+
+
+def bboxes_overlap(a, b):
+    return bool(np.all(a[0] <= b[1] + BBOX_TOLERANCE) and np.all(b[0] <= a[1] + BBOX_TOLERANCE))
+
+
+class CSGPlanner(object):
+    """
+       Evaluates a CSG tree, doing the cheap work first:
+
+        - nested unions are flattened and their operands are combined smallest first,
+          so the large meshes are touched as late as possible.
+        - operands whose bboxes do not overlap are merged without a boolean.
+        - the subtrahend of a difference is built before the minuend is touched and a
+          difference with a disjoint subtrahend is skipped.
+
+       Every node that gets evaluated is recorded in self.report with its triangle count
+       and the time it took.
+    """
+
+    def __init__(self, engine="igl", debug=False):
+        self.engine = engine
+        self.debug = debug
+        self.report = []
+
+
+    def record(self, name, operation, mesh, t0, depth):
+        self.report.append((depth, name, operation, mesh.num_faces, time() - t0))
+        if self.debug:
+            save_mesh(name, mesh)
+
+
+    def evaluate(self, node, depth=0):
+        t0 = time()
+        if node.operation is None:
+            mesh = node.mesh
+            operation = "mesh"
+        elif node.operation == "union":
+            mesh = self.evaluate_union(node, depth)
+            operation = "union"
+        elif node.operation == "difference":
+            mesh = self.evaluate_difference(node, depth)
+            operation = "difference"
+        else:
+            raise ValueError("unknown CSG operation '%s'" % node.operation)
+
+        self.record(node.name, operation, mesh, t0, depth)
+        return mesh
+
+
+    def flatten_union(self, node):
+        operands = []
+        for operand in node.operands:
+            if operand.operation == "union":
+                operands.extend(self.flatten_union(operand))
+            else:
+                operands.append(operand)
+        return operands
+
+
+    def evaluate_union(self, node, depth):
+        meshes = [ self.evaluate(operand, depth + 1) for operand in self.flatten_union(node) ]
+        if not meshes:
+            raise ValueError("union '%s' has no operands" % node.name)
+
+        # combine the two smallest meshes until only one is left
+        heap = [ (mesh.num_faces, i, mesh, bbox_of(mesh)) for i, mesh in enumerate(meshes) ]
+        heapq.heapify(heap)
+        count = len(heap)
+        while len(heap) > 1:
+            faces_a, _, a, bbox_a = heapq.heappop(heap)
+            faces_b, _, b, bbox_b = heapq.heappop(heap)
+            if bboxes_overlap(bbox_a, bbox_b):
+                mesh = pymesh.boolean(a, b, operation="union", engine=self.engine)
+            else:
+                mesh = pymesh.merge_meshes([a, b])
+            bbox = (np.minimum(bbox_a[0], bbox_b[0]), np.maximum(bbox_a[1], bbox_b[1]))
+            heapq.heappush(heap, (mesh.num_faces, count, mesh, bbox))
+            count += 1
+
+        return heap[0][2]
+
+
+    def evaluate_difference(self, node, depth):
+        minuend, subtrahend = node.operands
+
+        # build the (usually small) subtrahend first, then touch the big mesh once
+        b = self.evaluate(subtrahend, depth + 1)
+        a = self.evaluate(minuend, depth + 1)
+        if not bboxes_overlap(bbox_of(a), bbox_of(b)):
+            return a
+
+        return pymesh.boolean(a, b, operation="difference", engine=self.engine)
+
+
+    def print_report(self):
+        """
+           Print the evaluated nodes as a tree, children before their parent.
+        """
+        for depth, name, operation, faces, seconds in self.report:
+            print("%s%-*s %-10s %10s faces %8.2fs" % ("  " * depth, 30 - 2 * depth, name, operation,
+                                                       "{:,}".format(faces), seconds))
+
+
+def evaluate(node, engine="igl", debug=False):
+    """
+       Evaluate a CSG tree and print the per node report.
+
+       returns the resulting mesh
+    """
+
+    planner = CSGPlanner(engine, debug)
+    mesh = planner.evaluate(node)
+    planner.print_report()
+
+    return mesh
@@ -0,0 +1,382 @@
+import numpy as np
+import pymesh
+from wearebeautiful.extrude import find_boundary_edges
+
+# Number of edges to score at once when the decimator starts up
+QEM_CHUNK = 1024 * 1024
+
+# A quadric whose 3x3 part has det / (trace / 3)^3 below this is treated as singular
+QEM_SINGULAR = 1e-6
+
+# A collapse may turn the faces around it by at most acos(QEM_FLIP_COS)
+QEM_FLIP_COS = 0.5
+
+# the 10 unique entries of a symmetric 4x4 quadric, stored row by row
+QUADRIC_INDEX = [ (i, j) for i in range(4) for j in range(i, 4) ]
+QUADRIC_FULL = np.array([ [ QUADRIC_INDEX.index((min(i, j), max(i, j))) for j in range(4) ] for i in range(4) ])
+
+
+def cross(a, b):
+    """ np.cross without the axis juggling, which dominates for small arrays """
+    return np.column_stack((a[:, 1] * b[:, 2] - a[:, 2] * b[:, 1],
+                            a[:, 2] * b[:, 0] - a[:, 0] * b[:, 2],
+                            a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]))
+
+
+def face_normals(vertices, faces):
+    """ returns the unnormalized normals of faces, their length is twice the face area """
+    a = vertices[faces[:, 0]]
+    return cross(vertices[faces[:, 1]] - a, vertices[faces[:, 2]] - a)
+
+
+def vertex_quadrics(vertices, faces):
+    """
+       Sum the area weighted plane quadrics of the faces around each vertex.
+
+       returns a (V, 10) array with the upper triangle of each 4x4 quadric
+    """
+
+    a = vertices[faces[:, 0]]
+    normals = face_normals(vertices, faces)
+    area2 = np.linalg.norm(normals, axis=1)
+    nonzero = area2 > 0.0
+    normals[nonzero] /= area2[nonzero][:, np.newaxis]
+    planes = np.column_stack((normals, -np.einsum('ij,ij->i', normals, a)))
+    weight = area2 / 2.0
+
+    quadrics = np.zeros((len(vertices), 10), dtype=np.float64)
+    for k, (i, j) in enumerate(QUADRIC_INDEX):
+        q = weight * planes[:, i] * planes[:, j]
+        for col in range(3):
+            quadrics[:, k] += np.bincount(faces[:, col], weights=q, minlength=len(vertices))
+
+    return quadrics
+
+
+def solve_quadrics(Q):
+    """
+       Solve A x = -b for a stack of quadrics [[A, b], [b^T, c]], with the adjugate
+       since the systems are only 3x3.
+
+       returns the solutions and a mask of the quadrics that are not singular
+    """
+
+    A = Q[:, :3, :3]
+    rhs = -Q[:, :3, 3]
+    adj = np.stack((cross(A[:, 1], A[:, 2]), cross(A[:, 2], A[:, 0]), cross(A[:, 0], A[:, 1])), axis=2)
+    det = np.einsum('ij,ij->i', A[:, 0], adj[:, :, 0])
+    trace = (A[:, 0, 0] + A[:, 1, 1] + A[:, 2, 2]) / 3.0
+    solvable = np.abs(det) > QEM_SINGULAR * trace ** 3
+
+    x = np.zeros((len(Q), 3), dtype=np.float64)
+    x[solvable] = np.einsum('kij,kj->ki', adj[solvable], rhs[solvable]) / det[solvable][:, np.newaxis]
+    return x, solvable
+
+
+def group_min(index, values, out):
+    """
+       out[i] = min(out[i], values[index == i]) for every i, index has to be sorted
+    """
+
+    starts = np.flatnonzero(np.concatenate(([True], index[1:] != index[:-1])))
+    if len(starts):
+        out[index[starts]] = np.minimum(out[index[starts]], np.minimum.reduceat(values, starts))
+    return out
+
+
+class QEMDecimator(object):
+    """
+       Quadric error metric edge collapse decimation (Garland & Heckbert). Vertices on
+       the boundary are locked: they are never moved or removed, so the outline of the
+       surface stays exactly as it was.
+
+       The collapses are applied in rounds, with flat numpy arrays and no per vertex
+       python objects. Every round takes the edges that are the cheapest edge of both
+       of their end points and drops the ones with an end point next to one of a
+       cheaper such edge. The end points of the remaining collapses are never
+       neighbours, so they can be checked and applied all at once and in any order.
+       Edges whose end points didn't change keep their cost from the previous round.
+
+       A collapse is skipped if it would make the surface non-manifold (the link
+       condition), turn a face around it too far or flip it against its original
+       orientation. It is tried again once something around it changes.
+
+       If record is set, the collapses are stored in self.records, cheapest first in
+       each round, as arrays of the kept vertices, removed vertices, new positions and
+       faces left. Running to a face count and replaying the records up to it give the
+       same mesh.
+    """
+
+    def __init__(self, vertices, faces, record=False):
+        self.vertices = np.array(vertices, dtype=np.float64)
+        self.faces = np.array(faces, dtype=np.int64)
+        self.num_faces = len(self.faces)
+        self.normals = face_normals(self.vertices, self.faces)
+        self.locked = np.zeros(len(self.vertices), dtype=bool)
+        self.locked[find_boundary_edges(self.faces).ravel()] = True
+        self.quadrics = vertex_quadrics(self.vertices, self.faces)
+        self.records = [] if record else None
+
+        # the costs of the last round, by edge key, and the vertices whose edges changed
+        self.edge_keys = np.zeros(0, dtype=np.int64)
+        self.edge_cost = np.zeros(0, dtype=np.float64)
+        self.edge_pos = np.zeros((0, 3), dtype=np.float64)
+        self.dirty = np.zeros(len(self.vertices), dtype=bool)
+
+        # rejected collapses by edge key, with the round they were rejected in, and
+        # the last round that changed the neighbourhood of each vertex
+        self.round = 0
+        self.rejected_keys = np.zeros(0, dtype=np.int64)
+        self.rejected_round = np.zeros(0, dtype=np.int64)
+        self.changed_round = np.zeros(len(self.vertices), dtype=np.int64)
+
+
+    def collapse_costs(self, a, b):
+        """
+           Find the best position and error for collapsing each edge (a, b).
+
+           returns cost, position arrays
+        """
+
+        q = self.quadrics[a] + self.quadrics[b]
+        Q = q[:, QUADRIC_FULL]
+        va = self.vertices[a]
+        vb = self.vertices[b]
+        mid = (va + vb) / 2.0
+
+        # the point with the least error is only usable if the quadric is not singular
+        # and the point stays near the edge
+        optimal, solvable = solve_quadrics(Q)
+        edge_len = np.linalg.norm(vb - va, axis=1)
+        solvable &= np.linalg.norm(optimal - mid, axis=1) <= edge_len
+
+        candidates = np.stack((optimal, va, vb, mid), axis=1)
+        homogeneous = np.concatenate((candidates, np.ones(candidates.shape[:2] + (1,))), axis=2)
+        cost = np.einsum('kci,kij,kcj->kc', homogeneous, Q, homogeneous)
+        cost[~solvable, 0] = np.inf
+
+        # locked vertices stay where they are
+        locked_a = self.locked[a]
+        locked_b = self.locked[b]
+        cost[locked_a | locked_b, 0] = np.inf
+        cost[locked_a | locked_b, 3] = np.inf
+        cost[locked_a, 2] = np.inf
+        cost[locked_b, 1] = np.inf
+
+        best = np.argmin(cost, axis=1)
+        rows = np.arange(len(best))
+        return np.maximum(cost[rows, best], 0.0), candidates[rows, best]
+
+
+    def edges(self):
+        """
+           Find the edges of the current faces and their collapse costs. Edges that are
+           not on exactly two faces or join two locked vertices can't be collapsed and
+           cost inf.
+
+           returns the edge keys, end points, costs and positions
+        """
+
+        a = self.faces.ravel()
+        b = self.faces[:, [1, 2, 0]].ravel()
+        keys, counts = np.unique((np.minimum(a, b) << 32) | np.maximum(a, b), return_counts=True)
+        a = keys >> 32
+        b = keys & 0xffffffff
+        collapsible = (counts == 2) & ~(self.locked[a] & self.locked[b])
+
+        # reuse the costs of the edges whose end points didn't change
+        idx = np.minimum(np.searchsorted(self.edge_keys, keys), max(len(self.edge_keys) - 1, 0))
+        known = (self.edge_keys[idx] == keys) if len(self.edge_keys) else np.zeros(len(keys), dtype=bool)
+        known &= ~(self.dirty[a] | self.dirty[b])
+
+        cost = np.full(len(keys), np.inf)
+        pos = np.zeros((len(keys), 3), dtype=np.float64)
+        cost[known] = self.edge_cost[idx[known]]
+        pos[known] = self.edge_pos[idx[known]]
+        todo = np.flatnonzero(collapsible & ~known)
+        for i in range(0, len(todo), QEM_CHUNK):
+            chunk = todo[i:i + QEM_CHUNK]
+            cost[chunk], pos[chunk] = self.collapse_costs(a[chunk], b[chunk])
+        cost[~collapsible] = np.inf
+
+        self.edge_keys, self.edge_cost, self.edge_pos = keys, cost, pos
+        self.dirty[:] = False
+
+        return keys, a, b, cost, pos
+
+
+    def select(self, keys, a, b, cost):
+        """
+           Pick the collapses of this round: of the edges that were not rejected since
+           their neighbourhood last changed, the ones that are the cheapest edge of both
+           of their end points and have no cheaper such edge next to them.
+
+           returns the indices of the edges, cheapest first
+        """
+
+        cost = cost.copy()
+        valid = self.rejected_round >= np.maximum(self.changed_round[self.rejected_keys >> 32],
+                                                  self.changed_round[self.rejected_keys & 0xffffffff])
+        self.rejected_keys = self.rejected_keys[valid]
+        self.rejected_round = self.rejected_round[valid]
+        cost[np.isin(keys, self.rejected_keys)] = np.inf
+
+        # rank the edges, so that ties are broken the same way everywhere
+        num_edges = len(keys)
+        rank = np.empty(num_edges, dtype=np.int64)
+        rank[np.argsort(cost)] = np.arange(num_edges)
+        rank[np.isinf(cost)] = num_edges
+
+        # the keys are sorted, so a is too and only b needs sorting to group by vertex
+        b_order = np.argsort(b, kind='stable')
+        b_sorted = b[b_order]
+
+        # the cheapest edge of each vertex, an edge that is the cheapest for both of its
+        # end points is a candidate
+        vertex_min = np.full(len(self.vertices), num_edges, dtype=np.int64)
+        group_min(a, rank, vertex_min)
+        group_min(b_sorted, rank[b_order], vertex_min)
+        candidate = (rank < num_edges) & (rank == vertex_min[a]) & (rank == vertex_min[b])
+
+        # of the candidates with end points next to each other only the cheapest stays,
+        # vertex_min now is the candidate on each vertex and near_min the cheapest one
+        # on it or its neighbours
+        vertex_min[:] = num_edges
+        vertex_min[a[candidate]] = rank[candidate]
+        vertex_min[b[candidate]] = rank[candidate]
+        near_min = vertex_min.copy()
+        group_min(a, vertex_min[b], near_min)
+        group_min(b_sorted, vertex_min[a][b_order], near_min)
+
+        selected = np.flatnonzero(candidate & (rank == near_min[a]) & (rank == near_min[b]))
+        return selected[np.argsort(rank[selected])]
+
+
+    def check(self, a, b, p, q, pos):
+        """
+           Check the collapses of edges (p, q) to pos, out of all the edges (a, b). A
+           collapse is only allowed if the end points have exactly two neighbours in
+           common (the link condition) and none of the faces around it turns too far or
+           ends up facing against its original orientation.
+
+           returns a bool array, True for the collapses that can be applied
+        """
+
+        count = len(p)
+        owner_of = np.full(len(self.vertices), -1, dtype=np.int64)
+        owner_of[p] = np.arange(count)
+        owner_of[q] = np.arange(count)
+
+        # the link condition, count the neighbours p and q have in common
+        owner = np.concatenate((owner_of[a], owner_of[b]))
+        neighbours = np.concatenate((b, a))
+        near = owner >= 0
+        pairs, repeats = np.unique((owner[near] << 32) | neighbours[near], return_counts=True)
+        common = np.bincount((pairs >> 32)[repeats == 2], minlength=count)
+        ok = common == 2
+
+        # the faces with one of the end points on them move, the two on the edge go away
+        face_owner = owner_of[self.faces].max(axis=1)
+        faces = np.flatnonzero(face_owner >= 0)
+        owner = face_owner[faces]
+        corners = self.faces[faces]
+        moved = (corners == p[owner][:, np.newaxis]) | (corners == q[owner][:, np.newaxis])
+        keep = moved.sum(axis=1) == 1
+        faces = faces[keep]
+        owner = owner[keep]
+        corners = corners[keep]
+        moved = moved[keep]
+
+        points = self.vertices[corners]
+        before = cross(points[:, 1] - points[:, 0], points[:, 2] - points[:, 0])
+        points[moved] = pos[owner]
+        after = cross(points[:, 1] - points[:, 0], points[:, 2] - points[:, 0])
+
+        turn = np.einsum('ij,ij->i', before, after)
+        limit = QEM_FLIP_COS * np.linalg.norm(before, axis=1) * np.linalg.norm(after, axis=1)
+        bad = (turn <= limit) | (np.einsum('ij,ij->i', self.normals[faces], after) <= 0.0)
+        ok &= np.bincount(owner[bad], minlength=count) == 0
+
+        return ok
+
+
+    def collapse(self, p, q, pos):
+        """
+           Apply a round of collapses of the edges (p, q), the unlocked end point is
+           merged into the other one, which moves to pos.
+        """
+
+        u = np.where(self.locked[q], q, p)
+        v = np.where(self.locked[q], p, q)
+
+        parent = np.arange(len(self.vertices))
+        parent[v] = u
+        faces = parent[self.faces]
+        alive = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+        self.faces = faces[alive]
+        self.normals = self.normals[alive]
+
+        if self.records is not None:
+            faces_left = self.num_faces - 2 * np.arange(1, len(u) + 1)
+            self.records.append((u, v, pos, faces_left))
+        self.num_faces = len(self.faces)
+
+        self.vertices[u] = pos
+        self.quadrics[u] += self.quadrics[v]
+        self.dirty[u] = True
+
+        # collapses that were rejected next to these may work now
+        touched = np.zeros(len(self.vertices), dtype=bool)
+        touched[u] = True
+        self.changed_round[self.faces[touched[self.faces].any(axis=1)].ravel()] = self.round
+
+
+    def run(self, target_faces):
+        """
+           Collapse edges until there are no more than target_faces faces left, or
+           nothing more can be collapsed. Every collapse removes the two faces on its
+           edge, the last round only applies as many of its (cheapest) collapses as
+           are needed.
+        """
+
+        while self.num_faces > target_faces:
+            self.round += 1
+            keys, a, b, cost, pos = self.edges()
+            selected = self.select(keys, a, b, cost)
+            if not len(selected):
+                break
+
+            p = a[selected]
+            q = b[selected]
+            ok = self.check(a, b, p, q, pos[selected])
+
+            rejected = selected[~ok]
+            self.rejected_keys = np.concatenate((self.rejected_keys, keys[rejected]))
+            self.rejected_round = np.concatenate((self.rejected_round, np.full(len(rejected), self.round)))
+
+            selected = selected[ok][:(self.num_faces - target_faces + 1) // 2]
+            if len(selected):
+                self.collapse(a[selected], b[selected], pos[selected])
+
+
+    def mesh(self):
+        """
+           returns the decimated mesh with unused vertices removed
+        """
+
+        used, faces = np.unique(self.faces, return_inverse=True)
+        return pymesh.form_mesh(self.vertices[used], faces.reshape(-1, 3))
+
+
+def decimate_mesh(mesh, target_faces):
+    """
+       Decimate mesh down to target_faces faces in one pass, keeping its boundary.
+
+       returns the decimated mesh
+    """
+
+    decimator = QEMDecimator(mesh.vertices, mesh.faces)
+    print("decimate mesh from %s to %s faces" % (f'{mesh.num_faces:,}', f'{int(target_faces):,}'))
+    decimator.run(target_faces)
+
+    return decimator.mesh()
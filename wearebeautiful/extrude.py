@@ -1,131 +1,222 @@
 import math
 import sys
 from random import random
+from collections import namedtuple
 
 import numpy as np
 import pymesh
-from scipy.spatial import Delaunay
 from wearebeautiful.utils import save_mesh, mesh_from_xy_points, flip_mesh, get_fast_bbox_2d
-from wearebeautiful.intersect import closed_segment_intersect
+from wearebeautiful.intersect import closed_segments_intersect
+from wearebeautiful.triangulate import triangulate_loops
 import matplotlib.pyplot as plt
 
 
 TOLERANCE = .00001
 
 
-def find_edges_with(i, edge_set):
-    i_first = [j for (x,j) in edge_set if x==i]
-    i_second = [j for (j,x) in edge_set if x==i]
-    return i_first,i_second
+BoundaryLoop = namedtuple("BoundaryLoop", ["edges", "length", "area"])
 
 
-def stitch_boundaries(edges):
-    edge_set = edges.copy()
+def loop_length_and_area(edges, vertices):
+    """
+       returns the 3D perimeter and the signed area of the XY projection of a loop
+    """
+
+    loop = np.array(edges, dtype=np.int64)
+    p0 = vertices[loop[:, 0]]
+    p1 = vertices[loop[:, 1]]
+    length = float(np.linalg.norm(p1 - p0, axis=1).sum())
+    area = 0.5 * float(np.sum(p0[:, 0] * p1[:, 1] - p1[:, 0] * p0[:, 1]))
+
+    return length, area
+
+
+def stitch_boundaries(edges, vertices):
+    """
+       Walk the boundary edges into closed loops using an adjacency map, so each
+       edge is visited once. Edges are followed in their own direction where
+       possible, so loops run the same way as the faces that own them.
+
+       returns a list of BoundaryLoop(edges, length, area), one for each loop
+    """
+
+    outgoing = {}
+    incoming = {}
+    for i, j in edges:
+        outgoing.setdefault(i, []).append(j)
+        incoming.setdefault(j, []).append(i)
 
     boundary_lst = []
-    while len(edge_set) > 0:
+    for i, j in edges:
+        if j not in outgoing.get(i, []):
+            continue
+
         boundary = []
-        edge0 = edge_set.pop()
-        boundary.append(edge0)
-        
-        last_edge = edge0
-        while len(edge_set) > 0:
-            i,j = last_edge
-            j_first, j_second = find_edges_with(j, edge_set)
-            if j_first:
-                edge_set.remove((j, j_first[0]))
-                edge_with_j = (j, j_first[0])
-                boundary.append(edge_with_j)
-                last_edge = edge_with_j
-            elif j_second:
-                edge_set.remove((j_second[0], j))
-                edge_with_j = (j, j_second[0])  # flip edge rep
-                boundary.append(edge_with_j)
-                last_edge = edge_with_j
-
-            if edge0[0] == last_edge[1]:
+        start = current = i
+        while True:
+            if outgoing.get(current):
+                next_vertex = outgoing[current].pop(0)
+                incoming[next_vertex].remove(current)
+            elif incoming.get(current):
+                next_vertex = incoming[current].pop(0)  # flip edge rep
+                outgoing[next_vertex].remove(current)
+            else:
+                break
+
+            boundary.append((current, next_vertex))
+            current = next_vertex
+            if current == start:
                 break
 
-        boundary_lst.append(boundary)
+        length, area = loop_length_and_area(boundary, vertices)
+        boundary_lst.append(BoundaryLoop(boundary, length, area))
 
     return boundary_lst
 
 
+def find_boundary_edges(faces):
+    """
+       Find the edges that are used by exactly one face. Each edge is packed
+       into an int64 key (low index in the upper bits) plus a flag bit that records
+       the direction the face uses it in. All the edges are counted in a single
+       sort pass.
+
+       returns the boundary edges as an (N, 2) array, oriented like the face that uses them
+    """
+
+    faces = np.asarray(faces)
+    num_faces = len(faces)
+    keys = np.empty(3 * num_faces, dtype=np.int64)
+    for i, (a, b) in enumerate(((0, 1), (1, 2), (2, 0))):
+        col_a = faces[:, a].astype(np.int64)
+        col_b = faces[:, b].astype(np.int64)
+        edge_keys = keys[i * num_faces:(i + 1) * num_faces]
+        np.minimum(col_a, col_b, out=edge_keys)
+        edge_keys <<= 32
+        edge_keys |= np.maximum(col_a, col_b)
+        edge_keys <<= 1
+        edge_keys |= col_a > col_b
+
+    keys.sort()
+    edge_keys = keys >> 1
+    differs = edge_keys[1:] != edge_keys[:-1]
+    single = np.concatenate(([True], differs)) & np.concatenate((differs, [True]))
+    keys = keys[single]
+
+    flipped = (keys & 1).astype(bool)
+    keys >>= 1
+    edges = np.column_stack((keys >> 32, keys & 0xffffffff))
+    edges[flipped] = edges[flipped][:, ::-1]
+
+    return edges
+
+
 def find_boundary(mesh):
+    """
+       returns all the boundary loops of the mesh, see stitch_boundaries
+    """
 
-    def inc(index, key):
-        try:
-            index[key] += 1
-        except KeyError:
-            index[key] = 1
-
-    refcounts = {}
-    for face in mesh.faces:
-        if face[0] < face[1]:
-            inc(refcounts, "%d-%d" % (face[0], face[1]))
-        else:
-            inc(refcounts, "%d-%d" % (face[1], face[0]))
-        if face[0] < face[2]:
-            inc(refcounts, "%d-%d" % (face[0], face[2]))
-        else:
-            inc(refcounts, "%d-%d" % (face[2], face[0]))
-        if face[1] < face[2]:
-            inc(refcounts, "%d-%d" % (face[1], face[2]))
-        else:
-            inc(refcounts, "%d-%d" % (face[2], face[1]))
-
-    edges = set()
-    points = set()
-    for edge in refcounts:
-        if refcounts[edge] == 1:
-            p0, p1 = edge.split("-")
-            edges.add((int(p0), int(p1)))
-            points.add(int(p0))
-            points.add(int(p1))
-    
+    edges = find_boundary_edges(mesh.faces)
     if len(edges) == 0:
         print("Could not find edge of the surface. Is this a solid??")
         sys.exit(-1)
 
+    return stitch_boundaries(edges.tolist(), mesh.vertices)
+
 
-    return stitch_boundaries(edges)[0]
+def find_outer_boundary(loops):
+    """
+       The outer boundary of a surface is the loop that encloses the largest area.
+       Ties are broken by loop order, which is deterministic.
+    """
+
+    return max(loops, key=lambda loop: abs(loop.area))
 
 def dist(pt0, pt1):
     return math.sqrt(math.pow(pt1[0] - pt0[0], 2) + math.pow(pt1[1] - pt0[1], 2))
 
 
+def find_self_intersections(points):
+    """
+       Find the segments of the closed polygon given by points that intersect each other.
+       The segments are binned into a uniform grid and only segments that share a grid
+       cell are tested, in one batch with closed_segments_intersect.
+
+       returns a (N, 2) array of segment index pairs (i < j), segment i runs from
+       points[i] to points[i + 1]
+    """
+
+    pts = np.asarray(points, dtype=np.float64)[:, :2]
+    num_segments = len(pts)
+    if num_segments < 3:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    seg_start = pts
+    seg_end = np.roll(pts, -1, axis=0)
+    seg_min = np.minimum(seg_start, seg_end)
+    seg_max = np.maximum(seg_start, seg_end)
+
+    # cells about twice the size of a typical segment keep the per cell lists short
+    cell_size = 2.0 * np.median(np.linalg.norm(seg_end - seg_start, axis=1))
+    if cell_size <= 0.0:
+        cell_size = 1.0
+    origin = seg_min.min(axis=0)
+    cell_min = ((seg_min - origin) // cell_size).astype(np.int64)
+    cell_max = ((seg_max - origin) // cell_size).astype(np.int64)
+
+    # enumerate every cell that the bbox of each segment covers
+    span = cell_max - cell_min + 1
+    counts = span[:, 0] * span[:, 1]
+    segments = np.repeat(np.arange(num_segments), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    span_x = np.repeat(span[:, 0], counts)
+    cell_x = np.repeat(cell_min[:, 0], counts) + offsets % span_x
+    cell_y = np.repeat(cell_min[:, 1], counts) + offsets // span_x
+    cells = cell_y * (cell_max[:, 0].max() + 1) + cell_x
+
+    order = np.lexsort((segments, cells))
+    cells = cells[order]
+    segments = segments[order]
+
+    # pair up the segments that share a cell, k entries apart in the sorted list
+    candidates = []
+    k = 1
+    while k < len(cells):
+        same = cells[k:] == cells[:-k]
+        if not same.any():
+            break
+        candidates.append(segments[:-k][same] * num_segments + segments[k:][same])
+        k += 1
+
+    if not candidates:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    candidates = np.unique(np.concatenate(candidates))
+    i = candidates // num_segments
+    j = candidates % num_segments
+    hits = closed_segments_intersect(seg_start[i], seg_end[i], seg_start[j], seg_end[j])
+
+    return np.column_stack((i[hits], j[hits]))
+
+
 def check_for_self_intersections(opts, mesh, points, points_int):
+    """
+       Check the boundary polygon given by points for self intersections. points_int
+       are the boundary edges the points were taken from.
 
-    si_points = set()
-
-    count = 0
-    for i in range(len(points)):
-        for j in range(len(points)):
-            if i == j:
-                continue
-            pt0 = points[i]
-            pt1 = points[(i + 1) % len(points)]
-            pt2 = points[j]
-            pt3 = points[(j + 1) % len(points)]
-            if closed_segment_intersect(pt0, pt1, pt2, pt3):
-                if i < j:
-                    si_points.add("%d-%d" % (i, j))
-                else:
-                    si_points.add("%d-%d" % (j, i))
-
-    si_points = list(si_points)
-    dots = []
-    for pt in si_points:
-        p0, p1 = pt.split('-')
-        p_xyz = mesh.vertices[int(p0)]
-        dots.append(pymesh.generate_icosphere(1, p_xyz))
-
-    if opts['debug']:
+       returns the intersecting segment pairs, see find_self_intersections
+    """
+
+    si_pairs = find_self_intersections(points)
+
+    if opts['debug'] and len(si_pairs):
+        dots = []
+        for i in np.unique(si_pairs):
+            dots.append(pymesh.generate_icosphere(1, mesh.vertices[points_int[i][0]]))
         dots.append(mesh)
-        mesh = pymesh.merge_meshes(dots)
-        save_mesh("si", mesh);
+        save_mesh("si", pymesh.merge_meshes(dots));
 
-    return len(si_points)
+    return si_pairs
 
 
 # This may need to be improved -- it picks the last matching point which may not be ideal.
@@ -163,63 +254,75 @@ def dedup_intersection_list(ints, p0, p1):
 
 
 def simple_extrude(mesh, opts, extrude_mm):
+    """
+       Turn a surface into a solid: walls go straight down from the outer boundary of the
+       surface to a flat floor extrude_mm below the lowest point of the surface. The floor
+       is a constrained triangulation of the boundary loop, so it only adds as many
+       vertices as the boundary has. The solid is assembled in preallocated arrays.
 
-    vertices = []
-    for vertex in mesh.vertices:
-        vertices.append((vertex[0], vertex[1], vertex[2]))
+       returns the solid mesh or None if the boundary intersects itself
+    """
 
-    num_vertices = len(vertices)
-    for vertex in mesh.vertices:
-        vertices.append((vertex[0], vertex[1], vertex[2]-extrude_mm))
+    top = np.asarray(mesh.vertices, dtype=np.float64)
+    num_vertices = len(top)
+    floor_z = top[:, 2].min() - extrude_mm
 
     print("find boundary")
-    edges = find_boundary(mesh)
+    loops = find_boundary(mesh)
+    if len(loops) > 1:
+        print("found %d boundary loops, using the outer one." % len(loops))
+    outer = find_outer_boundary(loops)
+    edges = np.array(outer.edges, dtype=np.int64)
 
     # from the edges, create a new triangulated mesh
-    edges_xy = []
-    for edge in edges:
-        edges_xy.append((mesh.vertices[edge[0]][0], mesh.vertices[edge[0]][1]))
-
-#    print("check for self intersections")
-#    count = check_for_self_intersections(opts, mesh, edges_xy, edges)
-
-    faces = []
-    for face in mesh.faces:
-        faces.append((face[0], face[1], face[2]))
-    for face in mesh.faces:
-        faces.append((face[0] + num_vertices, face[2] + num_vertices, face[1] + num_vertices))
-
-    panels = 0
-    for i, edge in enumerate(edges):
-#        p0t_xyz = list(vertices[edge[0]])
-#        p0b_xyz = list(vertices[edge[0] + num_vertices])
-#        ints0 = tree.rayIntersection(np.array([p0t_xyz, p0b_xyz],dtype=np.float32))
-
-#        p1t_xyz = list(vertices[edge[1]])
-#        p1b_xyz = list(vertices[edge[1] + num_vertices])
-#        ints1 = tree.rayIntersection(np.array([p1t_xyz, p1b_xyz],dtype=np.float32))
-
-#        ints0 = dedup_intersection_list(ints0, p0t_xyz, p0b_xyz)
-#        ints1 = dedup_intersection_list(ints0, p0t_xyz, p0b_xyz)
-
-#        if len(ints0):
-#            for i in ints0:
-#                print("0: %.4f " % (i.s), i.p)
-#        if len(ints1):
-#            for i in ints1:
-#                print("1: %.4f " % (i.s), i.p)
-
-        if True: #len(ints0) == 0 and len(ints1) == 0:
-            if opts['flip_walls']:
-                faces.append((edge[0], edge[0] + num_vertices, edge[1]))
-                faces.append((edge[1], edge[0] + num_vertices, edge[1] + num_vertices))
-            else:
-                faces.append((edge[0], edge[1], edge[0] + num_vertices))
-                faces.append((edge[1], edge[1] + num_vertices, edge[0] + num_vertices))
-            panels += 1
-
-    print("created %d panels" % panels)
-
-    solid = pymesh.form_mesh(np.array(vertices), np.array(faces))
-
-    return solid
+    edges_xy = top[edges[:, 0], :2]
+
+    print("check for self intersections")
+    si_pairs = check_for_self_intersections(opts, mesh, edges_xy, edges)
+    if len(si_pairs):
+        print("The boundary of the surface intersects itself in %d places:" % len(si_pairs))
+        for i, j in si_pairs[:10]:
+            print("  segment %d crosses segment %d near (%.3f, %.3f)" % (i, j, edges_xy[i][0], edges_xy[i][1]))
+        return None
+
+    print("triangulate floor")
+    points, floor_faces = triangulate_loops([edges_xy], remove_holes=False)
+
+    num_loop = len(edges)
+    vertices = np.empty((num_vertices + num_loop, 3), dtype=np.float64)
+    vertices[:num_vertices] = top
+    vertices[num_vertices:, :2] = edges_xy
+    vertices[num_vertices:, 2] = floor_z
+    del top
+
+    surface_faces = mesh.faces
+    num_faces = len(surface_faces)
+    num_floor = len(floor_faces)
+    faces = np.empty((num_faces + num_floor + 2 * num_loop, 3), dtype=np.int32)
+    faces[:num_faces] = surface_faces
+    del surface_faces
+
+    # The floor is the reverse of the top. The boundary runs the same way as the faces
+    # of the surface, so a counter clockwise loop (seen from above) means the surface
+    # faces up and the (counter clockwise) floor faces have to be turned to face down.
+    if outer.area > 0.0:
+        floor_faces = floor_faces[:, [0, 2, 1]]
+    faces[num_faces:num_faces + num_floor] = floor_faces + num_vertices
+
+    # The boundary runs the same way as the faces of the surface, so each wall uses its
+    # boundary edge the other way round, which keeps the solid consistently wound.
+    if not opts['flip_walls']:
+        print("flip_walls is ignored, the walls follow the winding of the surface.")
+
+    # floor vertex i sits below the start of boundary edge i
+    top0 = edges[:, 0]
+    top1 = edges[:, 1]
+    bottom0 = num_vertices + np.arange(num_loop)
+    bottom1 = num_vertices + (np.arange(num_loop) + 1) % num_loop
+    walls = faces[num_faces + num_floor:]
+    walls[:num_loop] = np.column_stack((top0, bottom0, top1))
+    walls[num_loop:] = np.column_stack((top1, bottom0, bottom1))
+
+    print("created %d panels" % num_loop)
+
+    return pymesh.form_mesh(vertices, faces)
@@ -0,0 +1,118 @@
+import sys
+import numpy as np
+from fontTools.ttLib import TTFont
+from fontTools.pens.basePen import BasePen
+from wearebeautiful.triangulate import triangulate_loops
+from wearebeautiful.extrude import find_boundary_edges
+
+# Number of line segments each glyph curve is flattened into
+GLYPH_CURVE_STEPS = 6
+
+
+class PolylinePen(BasePen):
+    """
+       A fontTools pen that flattens glyph outlines into closed polylines.
+    """
+
+    def __init__(self, glyph_set, steps):
+        BasePen.__init__(self, glyph_set)
+        self.steps = steps
+        self.contours = []
+        self.current = []
+
+    def _moveTo(self, pt):
+        self.current = [pt]
+
+    def _lineTo(self, pt):
+        self.current.append(pt)
+
+    def _curveToOne(self, pt1, pt2, pt3):
+        pt0 = self._getCurrentPoint()
+        for t in np.linspace(0.0, 1.0, self.steps + 1)[1:]:
+            self.current.append(tuple((1 - t) ** 3 * np.array(pt0) + 3 * (1 - t) ** 2 * t * np.array(pt1) +
+                                      3 * (1 - t) * t ** 2 * np.array(pt2) + t ** 3 * np.array(pt3)))
+
+    def _qCurveToOne(self, pt1, pt2):
+        pt0 = self._getCurrentPoint()
+        for t in np.linspace(0.0, 1.0, self.steps + 1)[1:]:
+            self.current.append(tuple((1 - t) ** 2 * np.array(pt0) + 2 * (1 - t) * t * np.array(pt1) +
+                                      t ** 2 * np.array(pt2)))
+
+    def _closePath(self):
+        if len(self.current) > 2:
+            self.contours.append(self.current)
+        self.current = []
+
+    def _endPath(self):
+        self._closePath()
+
+
+def text_outlines(text, font_file, steps=GLYPH_CURVE_STEPS):
+    """
+       Lay out text in a single line (without kerning) and flatten the glyph outlines.
+
+       returns a list of (N, 2) arrays in font units, one per closed contour
+    """
+
+    try:
+        font = TTFont(font_file)
+    except IOError as err:
+        print("cannot load font %s: %s" % (font_file, str(err)))
+        sys.exit(-1)
+
+    glyph_set = font.getGlyphSet()
+    cmap = font.getBestCmap()
+
+    contours = []
+    advance = 0
+    for ch in text:
+        glyph = glyph_set[cmap.get(ord(ch), ".notdef")]
+        pen = PolylinePen(glyph_set, steps)
+        glyph.draw(pen)
+        for contour in pen.contours:
+            contour = np.array(contour, dtype=np.float64)
+
+            # drop repeated points, including the closing point
+            keep = np.any(contour != np.roll(contour, 1, axis=0), axis=1)
+            contour = contour[keep]
+            if len(contour) > 2:
+                contour[:, 0] += advance
+                contours.append(contour)
+
+        advance += glyph.width
+
+    return contours
+
+
+def make_vector_text_mesh(text, font_file, depth):
+    """
+       Build a label from the glyph outlines of the font: the outlines are triangulated
+       as 2D polygons and extruded along z. x/y are in font units (the label gets scaled
+       to fit the frame later on), the extrusion depth is kept as given.
+
+       returns vertices, faces arrays
+    """
+
+    contours = text_outlines(text, font_file)
+    if not contours:
+        return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int32)
+
+    points, faces = triangulate_loops(contours)
+    num_points = len(points)
+
+    vertices = np.empty((2 * num_points, 3), dtype=np.float64)
+    vertices[:num_points, :2] = vertices[num_points:, :2] = points
+    vertices[:num_points, 2] = depth
+    vertices[num_points:, 2] = 0.0
+
+    # boundary edges run counter clockwise around the filled area, like the faces
+    edges = find_boundary_edges(faces)
+    a = edges[:, 0]
+    b = edges[:, 1]
+    walls = np.concatenate((np.column_stack((b, a, a + num_points)),
+                            np.column_stack((b, a + num_points, b + num_points))))
+
+    faces = np.concatenate((faces, faces[:, ::-1] + num_points, walls))
+
+    used, faces = np.unique(faces, return_inverse=True)
+    return vertices[used], faces.reshape(-1, 3).astype(np.int32)
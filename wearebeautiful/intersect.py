@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def side(a,b,c):
     """ Returns a position of the point c relative to the line going through a and b
         Points a, b are expected to be different
@@ -57,7 +60,52 @@ def closed_segment_intersect(a,b,c,d):
 
     return True
 
+
+def sides(a, b, c):
+    """ Batched version of side(): a, b, c are (N, 2) arrays of points.
+        Returns an array of -1, 0, 1 values.
+    """
+    d = (c[:, 1] - a[:, 1]) * (b[:, 0] - a[:, 0]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+    return np.sign(d)
+
+
+def are_points_in_closed_segments(a, b, c):
+    """ Batched version of is_point_in_closed_segment(). a, b, c are (N, 2) arrays
+        of points that are expected to be collinear.
+    """
+    return (np.minimum(a[:, 0], b[:, 0]) <= c[:, 0]) & (c[:, 0] <= np.maximum(a[:, 0], b[:, 0])) & \
+           (np.minimum(a[:, 1], b[:, 1]) <= c[:, 1]) & (c[:, 1] <= np.maximum(a[:, 1], b[:, 1]))
+
+
+def closed_segments_intersect(a, b, c, d):
+    """ Batched version of closed_segment_intersect(): tests segment a[i]-b[i] against
+        c[i]-d[i] for every i. All arguments are (N, 2) arrays.
+        Returns a boolean array.
+    """
+
+    def same(p, q):
+        return (p[:, 0] == q[:, 0]) & (p[:, 1] == q[:, 1])
+
+    # if the ends touch, we consider it to be not intersecting in this case
+    touching = same(a, c) | same(a, d) | same(b, c) | same(b, d)
+    degenerate = same(a, b) | same(c, d)
+
+    s1 = sides(a, b, c)
+    s2 = sides(a, b, d)
+    s3 = sides(c, d, a)
+    s4 = sides(c, d, b)
+
+    collinear = (s1 == 0) & (s2 == 0)
+    overlapping = are_points_in_closed_segments(a, b, c) | are_points_in_closed_segments(a, b, d) | \
+                  are_points_in_closed_segments(c, d, a) | are_points_in_closed_segments(c, d, b)
+    crossing = ~((s1 != 0) & (s1 == s2)) & ~((s3 != 0) & (s3 == s4))
+
+    return ~touching & ~degenerate & np.where(collinear, overlapping, crossing)
+
+
 if __name__ == "__main__":
     assert(closed_segment_intersect((1,1), (2,2), (1,2), (2,1)) == True)
     assert(closed_segment_intersect((1,3), (1, 4), (1,3), (2,3)) == False)
     assert(closed_segment_intersect((1,1), (2, 2), (3,3), (4,4)) == False)
+    assert(list(closed_segments_intersect(np.array([(1,1), (1,3), (1,1)]), np.array([(2,2), (1,4), (2,2)]),
+                                          np.array([(1,2), (1,3), (3,3)]), np.array([(2,1), (2,3), (4,4)]))) == [True, False, False])
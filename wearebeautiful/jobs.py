@@ -0,0 +1,115 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from wearebeautiful.stl import binary_stl_faces
+
+# Rough peak memory of processing one model: a fixed overhead for the interpreter and
+# libraries plus an amount per face of the largest input mesh, which covers the
+# booleans for the solid and the remeshing for the lower resolution surfaces.
+MEMORY_BASE = 256 * 1024 * 1024   # MB
+MEMORY_PER_FACE = 2 * 1024
+
+# Use this fraction of the memory available to the container by default
+MEMORY_BUDGET_FRACTION = .75
+
+
+def stl_face_count(filename):
+    """
+       Read the face count of a binary STL file from its header. ASCII STL files don't
+       have one, their face count is estimated from the file size (about 250 bytes per
+       facet).
+
+       returns the number of faces
+    """
+
+    num_faces = binary_stl_faces(filename)
+    if num_faces is not None:
+        return num_faces
+
+    return os.path.getsize(filename) // 250
+
+
+def estimate_memory(filenames):
+    """
+       returns the estimated peak memory in bytes needed to process a model with the
+       given input meshes
+    """
+
+    faces = max([ stl_face_count(f) for f in filenames if os.path.exists(f) ] + [ 0 ])
+    return MEMORY_BASE + MEMORY_PER_FACE * faces
+
+
+def available_memory():
+    """
+       returns the memory limit of the container (cgroup v2 or v1) or if there is none,
+       the physical memory of the machine in bytes
+    """
+
+    physical = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    for limit_file in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(limit_file, "r") as f:
+                limit = f.read().strip()
+        except IOError:
+            continue
+        if limit.isdigit():
+            return min(int(limit), physical)
+
+    return physical
+
+
+def default_memory_budget():
+    return int(available_memory() * MEMORY_BUDGET_FRACTION)
+
+
+def run_jobs(jobs, func, tasks, memory_budget):
+    """
+       Run func(*args) for each (name, memory, args) in tasks in a pool of jobs processes.
+       Tasks are started in order, but only while the estimated memory of the running
+       tasks stays under memory_budget. A task that needs more than the whole budget
+       runs on its own.
+
+       func returns True on success. returns the list of names of the failed tasks.
+    """
+
+    failed = []
+    pending = list(tasks)
+    running = {}
+    in_use = 0
+    broken = False
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            while pending and len(running) < jobs:
+                name, memory, args = pending[0]
+                if running and in_use + memory > memory_budget:
+                    break
+                pending.pop(0)
+                print("start %s (estimated %sMb, %sMb in use)" % (name, f'{memory // (1024 * 1024):,}',
+                                                                   f'{(in_use + memory) // (1024 * 1024):,}'))
+                running[pool.submit(func, *args)] = (name, memory)
+                in_use += memory
+
+            done, __ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, memory = running.pop(future)
+                in_use -= memory
+                try:
+                    ok = future.result()
+                except BrokenProcessPool:
+                    print("%s: the process pool broke, a worker was probably killed for running out of memory." % name)
+                    ok = False
+                    broken = True
+                except (Exception, SystemExit) as err:
+                    print("%s: %s" % (name, repr(err)))
+                    ok = False
+
+                if not ok:
+                    failed.append(name)
+
+            # a killed worker breaks the pool, nothing else can be started on it
+            if broken:
+                failed.extend([ name for name, memory, args in pending ])
+                pending = []
+
+    return failed
@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+import pymesh
+
+LABEL_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cache", "labels")
+LABEL_CACHE_MAX_SIZE = 256 * 1024 * 1024   # 256MB
+
+font_hashes = {}
+
+
+def hash_file(filename):
+    if filename not in font_hashes:
+        h = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        font_hashes[filename] = h.hexdigest()
+
+    return font_hashes[filename]
+
+
+def label_key(text, large, font_file, params):
+    """
+       Make a cache key for a label mesh. The key covers everything that goes into
+       rendering the label: the text, the size class, the contents of the font file
+       and the render parameters.
+    """
+
+    key = {
+        'text' : text,
+        'large' : bool(large),
+        'font' : hash_file(font_file),
+        'params' : params,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def cache_file(key):
+    return os.path.join(LABEL_CACHE_DIR, key + ".npz")
+
+
+def load_label_mesh(key):
+    """
+       returns the cached label mesh for key or None if it is not cached.
+    """
+
+    filename = cache_file(key)
+    try:
+        with np.load(filename) as data:
+            mesh = pymesh.form_mesh(data['vertices'], data['faces'])
+    except (IOError, ValueError, KeyError):
+        return None
+
+    # touch the file so that eviction removes the least recently used labels first
+    try:
+        os.utime(filename)
+    except OSError:
+        pass
+
+    return mesh
+
+
+def save_label_mesh(key, mesh):
+    """
+       Store a label mesh in the cache and evict old labels if the cache grew too big.
+    """
+
+    try:
+        os.makedirs(LABEL_CACHE_DIR)
+    except FileExistsError:
+        pass
+
+    # write to a temp file and rename, so concurrent runs never see a partial file
+    fd, temp_file = tempfile.mkstemp(dir=LABEL_CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, vertices=mesh.vertices, faces=mesh.faces)
+        os.replace(temp_file, cache_file(key))
+    except IOError as err:
+        print("cannot write label cache: %s" % str(err))
+        try:
+            os.unlink(temp_file)
+        except OSError:
+            pass
+        return
+
+    evict_labels(LABEL_CACHE_MAX_SIZE)
+
+
+def evict_labels(max_size):
+    """
+       Remove the least recently used labels until the cache is below max_size bytes.
+    """
+
+    entries = []
+    for item in os.listdir(LABEL_CACHE_DIR):
+        if not item.endswith(".npz"):
+            continue
+        filename = os.path.join(LABEL_CACHE_DIR, item)
+        try:
+            st = os.stat(filename)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, filename))
+
+    total = sum([ size for mtime, size, filename in entries ])
+    for mtime, size, filename in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.unlink(filename)
+            total -= size
+        except OSError:
+            pass
@@ -0,0 +1,183 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pymesh
+from wearebeautiful import stl
+
+MESH_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cache", "meshes")
+MESH_CACHE_MAX_SIZE = 8 * 1024 * 1024 * 1024   # GB
+# Bump this when the cached arrays are made differently, so old entries are not used
+MESH_CACHE_FORMAT = 1
+# The hashes of the sources are kept outside MESH_CACHE_DIR, so eviction leaves them alone
+SOURCE_HASH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cache", "sources")
+
+# (filename, size, mtime) -> sha256 of the contents, so a file is hashed once per run
+source_hashes = {}
+
+
+def hash_source(filename):
+    """
+       returns the sha256 of the contents of filename. It is stored in SOURCE_HASH_DIR
+       along with the size and mtime of the file, so an unchanged file is not read again
+       on later runs either.
+    """
+
+    filename = os.path.abspath(filename)
+    st = os.stat(filename)
+    key = (filename, st.st_size, st.st_mtime_ns)
+    if key in source_hashes:
+        return source_hashes[key]
+
+    sidecar = os.path.join(SOURCE_HASH_DIR, hashlib.sha256(filename.encode('utf-8')).hexdigest())
+    try:
+        with open(sidecar, "r") as f:
+            cached = json.loads(f.read())
+        if cached['size'] == st.st_size and cached['mtime'] == st.st_mtime_ns:
+            source_hashes[key] = cached['hash']
+            return source_hashes[key]
+    except (IOError, ValueError, KeyError):
+        pass
+
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    source_hashes[key] = h.hexdigest()
+
+    # write to a temp file and rename, so concurrent runs never see a partial file
+    try:
+        os.makedirs(SOURCE_HASH_DIR, exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(dir=SOURCE_HASH_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(json.dumps({ 'size' : st.st_size, 'mtime' : st.st_mtime_ns, 'hash' : source_hashes[key] }))
+        os.replace(temp_file, sidecar)
+    except (IOError, OSError) as err:
+        print("cannot save source hash to %s: %s" % (sidecar, str(err)))
+
+    return source_hashes[key]
+
+
+def mesh_key(filename):
+    """
+       returns the cache key of the parsed mesh of filename. Besides the contents of the
+       file it covers the weld tolerance and the cache format, which change the arrays.
+    """
+
+    key = { 'source' : hash_source(filename), 'weld' : stl.STL_WELD_QUANTUM, 'format' : MESH_CACHE_FORMAT }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def cache_dir(key):
+    return os.path.join(MESH_CACHE_DIR, key)
+
+
+def load_cached_arrays(key):
+    """
+       returns the memory mapped vertices and faces arrays for key or None if they are
+       not cached.
+    """
+
+    dir = cache_dir(key)
+    try:
+        vertices = np.load(os.path.join(dir, "vertices.npy"), mmap_mode="r")
+        faces = np.load(os.path.join(dir, "faces.npy"), mmap_mode="r")
+    except (IOError, ValueError):
+        return None
+
+    # touch the dir so that eviction removes the least recently used meshes first
+    try:
+        os.utime(dir)
+    except OSError:
+        pass
+
+    return vertices, faces
+
+
+def save_cached_arrays(key, vertices, faces):
+    """
+       Store the arrays of a mesh in the cache and evict old meshes if the cache grew
+       too big.
+    """
+
+    try:
+        os.makedirs(MESH_CACHE_DIR)
+    except FileExistsError:
+        pass
+
+    # write to a temp dir and rename, so concurrent runs never see a partial entry
+    temp_dir = tempfile.mkdtemp(dir=MESH_CACHE_DIR, suffix=".tmp")
+    try:
+        np.save(os.path.join(temp_dir, "vertices.npy"), np.ascontiguousarray(vertices, dtype=np.float64))
+        np.save(os.path.join(temp_dir, "faces.npy"), np.ascontiguousarray(faces, dtype=np.int32))
+        os.rename(temp_dir, cache_dir(key))
+    except OSError as err:
+        # another run may have cached the same mesh in the meantime
+        if not os.path.isdir(cache_dir(key)):
+            print("cannot write mesh cache: %s" % str(err))
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return
+
+    evict_meshes(MESH_CACHE_MAX_SIZE)
+
+
+def evict_meshes(max_size):
+    """
+       Remove the least recently used meshes until the cache is below max_size bytes.
+    """
+
+    entries = []
+    for item in os.listdir(MESH_CACHE_DIR):
+        dir = os.path.join(MESH_CACHE_DIR, item)
+        if item.endswith(".tmp") or not os.path.isdir(dir):
+            continue
+        try:
+            size = sum([ os.path.getsize(os.path.join(dir, f)) for f in os.listdir(dir) ])
+            entries.append((os.stat(dir).st_mtime, size, dir))
+        except OSError:
+            continue
+
+    total = sum([ size for mtime, size, dir in entries ])
+    for mtime, size, dir in sorted(entries):
+        if total <= max_size:
+            break
+        shutil.rmtree(dir, ignore_errors=True)
+        total -= size
+
+
+def load_mesh_arrays(filename):
+    """
+       Load the welded vertices and faces of a mesh file. The arrays are cached by the
+       mesh_key of the file, so later loads of an unchanged file map the cached arrays
+       instead of parsing it again. The returned arrays are read only.
+
+       returns vertices, faces
+    """
+
+    key = mesh_key(filename)
+    arrays = load_cached_arrays(key)
+    if arrays is not None:
+        return arrays
+
+    if stl.binary_stl_faces(filename) is not None:
+        vertices, faces = stl.read_stl(filename)
+    else:
+        mesh = pymesh.meshio.load_mesh(filename)
+        vertices, faces = mesh.vertices, mesh.faces
+
+    save_cached_arrays(key, vertices, faces)
+    arrays = load_cached_arrays(key)
+    if arrays is not None:
+        return arrays
+
+    return vertices, faces
+
+
+def load_mesh(filename):
+    """
+       Load a mesh through the mesh cache.
+    """
+
+    return pymesh.form_mesh(*load_mesh_arrays(filename))
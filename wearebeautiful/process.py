@@ -1,43 +1,127 @@
 import os
-import sys
 import json
 import shutil
-import subprocess
 from copy import copy
-import pymesh
-from wearebeautiful.solid import make_solid
+import numpy as np
+from wearebeautiful.solid import make_solid, FONT_FILE
 from make_solid import default_opts
-from wearebeautiful.scale import downsample_mesh
+from wearebeautiful.scale import downsample_mesh, extract_lod, stl_faces, load_segment_lens, save_segment_len, \
+    DOWNSAMPLE_JOBS
+from wearebeautiful.progressive import load_progressive_mesh
 from wearebeautiful.manifest import validate_manifest, make_code
-from wearebeautiful.utils import rotate, center_around_origin
+from wearebeautiful.transform import Transform
+from wearebeautiful.stl import load_mesh, save_mesh, binary_stl_faces, stl_bbox, transform_stl
+from wearebeautiful.stages import Stage, run_stages
+from wearebeautiful.build_state import BuildState, BUILD_STATE_FILE
+from wearebeautiful.archive import copy_and_compress, codec_extension, check_codec, ARCHIVE_THREADS
 import config
 
 DEFAULT_MED_SURFACE_LEN = .3
 DEFAULT_LOW_SURFACE_LEN = .5
+DEFAULT_LOD_ENGINE = "remesh"
 SURFACE_MED_TARGET_SIZE = 10 * 1024 * 1024   # MB 
 SURFACE_LOW_TARGET_SIZE = 3 * 1024 * 1024   # MB 
+# Kept in the model dir, so it must not end in .json: create_db reads every .json file
+# there as a manifest
+SEGMENT_LEN_FILE = ".%s.segment_lens"
+LOD_OPTS = ('surface_med_len', 'surface_low_len', 'lod_engine')
+# The modules that make each kind of output. Their sources and those of the modules they
+# import go into the build state. The surface and manifest copies don't depend on any.
+SOLID_TOOLS = ('solid',)
+LOD_TOOLS = ('scale', 'progressive')
+PROGRESSIVE_MIN_TARGET_SIZE = 1 * 1024 * 1024   # MB, leaves room for a thumbnail tier
+STAGE_JOBS = 3   # the solid and the medium and low surfaces
+
+def transform_mesh(src_file, rotation=None, scale=None, center=False, dest_file=None):
+    """
+       Rotate around the x, y and z axes (in degrees, in that order), scale and center a
+       mesh. The steps are collected in one matrix, so a binary STL file is rewritten in
+       place in a single pass over fixed size chunks and never loaded as a whole. Other
+       formats are loaded and saved with pymesh. If dest_file is given, the result goes
+       there instead of back to src_file.
+    """
+
+    if dest_file and os.path.abspath(dest_file) != os.path.abspath(src_file):
+        if binary_stl_faces(src_file) is not None and dest_file.lower().endswith(".stl"):
+            shutil.copyfile(src_file, dest_file)
+            src_file = dest_file
+    else:
+        dest_file = src_file
+
+    binary = src_file == dest_file and binary_stl_faces(src_file) is not None
+    if binary:
+        xform = Transform.from_bbox(stl_bbox(src_file), lambda matrix: stl_bbox(src_file, matrix))
+    else:
+        xform = Transform(load_mesh(src_file))
+
+    for axis, angle in zip(((1, 0, 0), (0, 1, 0), (0, 0, 1)), rotation or ()):
+        if angle:
+            xform.rotate((0,0,0), axis, angle)
+
+    if scale is not None and scale != 1.0:
+        xform.scale((scale, scale, scale))
+
+    if center:
+        xform.center_around_origin()
+
+    if binary:
+        if not np.array_equal(xform.matrix, np.identity(4)):
+            transform_stl(src_file, xform.matrix)
+    else:
+        save_mesh(dest_file, xform.apply())
+
+
+def center_mesh(filename, rotation=None, scale=None):
+    transform_mesh(os.path.join("/archive", filename), rotation, scale, True)
+
+
+def rotate_mesh(filename, rot_x, rot_y, rot_z, scale=None, center=False):
+    transform_mesh(os.path.join("/archive", filename), (rot_x, rot_y, rot_z), scale, center)
+
+
+def make_surface_lod(surface, target_size, out_file, engine, segment_len, jobs, mesh=None):
+    """
+       Make a lower resolution copy of the surface. The qem engine extracts it from the
+       progressive mesh of the model, which is only built the first time. The remesh
+       engine starts from segment_len, the length that worked last time, and tries
+       jobs lengths at once.
+
+       returns the segment length that worked now or None
+    """
+
+    if engine == "qem":
+        pm = load_progressive_mesh(surface, stl_faces(PROGRESSIVE_MIN_TARGET_SIZE), mesh)
+        extract_lod(pm, target_size, out_file)
+        return None
+
+    return downsample_mesh(False, target_size, surface, out_file, segment_len, engine, jobs, mesh)
+
 
-def center_mesh(filename):
-    src_file = os.path.join("/archive", filename)
-    mesh = pymesh.meshio.load_mesh(src_file);
-    mesh = center_around_origin(mesh)
-    pymesh.meshio.save_mesh(src_file, mesh);
+def make_surface_lods(surface, targets, engine, segment_lens, jobs, mesh=None):
+    """
+       Make the lower resolution copies for the (target_size, out_file) pairs in targets.
 
+       returns a dict of the segment lengths to start from next time by target size
+    """
 
-def rotate_mesh(filename, rot_x, rot_y, rot_z):
-    src_file = os.path.join("/archive", filename)
-    mesh = pymesh.meshio.load_mesh(src_file);
+    lens = {}
+    for target_size, out_file in targets:
+        lens[target_size] = make_surface_lod(surface, target_size, out_file, engine,
+                                             segment_lens.get(str(target_size)), jobs, mesh)
 
-    if rot_x:
-        mesh = rotate(mesh, (0,0,0), (1, 0, 0), rot_x)
+    return lens
 
-    if rot_y:
-        mesh = rotate(mesh, (0,0,0), (0, 1, 0), rot_y)
 
-    if rot_z:
-        mesh = rotate(mesh, (0,0,0), (0, 0, 1), rot_z)
+def copy_manifest(manifest, manifest_file, manifest_file_git):
+    shutil.copyfile(manifest, manifest_file)
+    shutil.copyfile(manifest_file, manifest_file_git)
 
-    pymesh.meshio.save_mesh(src_file, mesh);
+
+def get_surface_path(id, code, version):
+    if version > 1:
+        return os.path.join(config.SURFACE_DIR, id, code + "-%d" % version)
+
+    return os.path.join(config.SURFACE_DIR, id, code)
 
 
 def get_dest_paths(mjson, dest_dir):
@@ -58,14 +142,16 @@ def get_dest_paths(mjson, dest_dir):
     return solid_file, surface_file, surface_med_file, surface_low_file, manifest_file
 
 
-def process_surface(id, code, version, force = False):
+def process_surface(id, code, version, force = False, lod_jobs = DOWNSAMPLE_JOBS, codec = "gzip", stage_jobs = STAGE_JOBS):
 
     processed = 0
 
-    if version > 1:
-        path = os.path.join(config.SURFACE_DIR, id, code + "-%d" % version)
-    else:
-        path = os.path.join(config.SURFACE_DIR, id, code)
+    msg = check_codec(codec)
+    if msg:
+        print(msg)
+        return False
+
+    path = get_surface_path(id, code, version)
     print(path)
     manifest = os.path.join(path, "manifest.json")
     if not os.path.exists(manifest):
@@ -128,6 +214,8 @@ def process_surface(id, code, version, force = False):
         opts['surface_med_len'] = DEFAULT_MED_SURFACE_LEN
     if 'surface_low_len' not in opts:
         opts['surface_low_len'] = DEFAULT_LOW_SURFACE_LEN
+    if 'lod_engine' not in opts:
+        opts['lod_engine'] = DEFAULT_LOD_ENGINE
 
     # Set up the plain copy destination
     dest_dir = os.path.join(config.MODEL_DIR, mjson['id'], code)
@@ -145,56 +233,95 @@ def process_surface(id, code, version, force = False):
         pass
     solid_file_gz, surface_file_gz, surface_med_file_gz, surface_low_file_gz, manifest_file_git = get_dest_paths(mjson, comp_dest_dir)
 
-    # Now do stuff!
-    if force or (not os.path.exists(solid_file)) or (not os.path.exists(solid_file_gz + ".gz")):
+    segment_len_file = os.path.join(dest_dir, SEGMENT_LEN_FILE % make_code(manifest=mjson, force_version=True))
+    segment_lens = load_segment_lens(segment_len_file)
+
+    # Every output records what it was built from, only the ones whose inputs, options
+    # or tools changed are built again.
+    state = BuildState(os.path.join(dest_dir, BUILD_STATE_FILE % make_code(manifest=mjson, force_version=True)))
+    solid_opts = { k : opts[k] for k in opts if k not in LOD_OPTS }
+    solid_inputs = [ solid_input if is_solid else surface, manifest, FONT_FILE ]
+    lod_opts = { 'lod_engine' : opts['lod_engine'] }
+
+    ext = codec_extension(codec)
+
+    # The work for the model is a small graph of stages, each one only builds what is
+    # out of date. The solid and the lower resolution surfaces only depend on the input,
+    # so they are built at the same time, and each archive copy starts as soon as the
+    # file it copies is written. The qem engine builds both surfaces from one progressive
+    # mesh, so they stay in one stage. records lists the stages each output needs.
+    stages = []
+    records = []
+    if force or not state.is_current(surface_file, [ surface ], {}, [ surface_file, surface_file_gz + ext ]):
+        stages.append(Stage("surface archive", copy_and_compress, (surface, surface_file, surface_file_gz + ext, codec),
+                            [ surface ], [ surface_file, surface_file_gz + ext ]))
+        records.append((surface_file, [ surface ], {}, (), [ "surface archive" ]))
+
+    if force or not state.is_current(manifest_file, [ manifest ], {}, [ manifest_file, manifest_file_git ]):
+        stages.append(Stage("manifest", copy_manifest, (manifest, manifest_file, manifest_file_git),
+                            [ manifest ], [ manifest_file, manifest_file_git ]))
+        records.append((manifest_file, [ manifest ], {}, (), [ "manifest" ]))
+
+    if force or not state.is_current(solid_file, solid_inputs, solid_opts, [ solid_file, solid_file_gz + ext ],
+                                     SOLID_TOOLS):
         if is_solid:
             print("apply code and url to solid: %s" % solid_input)
-            if not make_solid(gen_code, solid_input, solid_file, opts):
-                return False
         else:
             print("create solid: %s" % solid_file)
-            if not make_solid(gen_code, surface, solid_file, opts):
-                return False
-        shutil.copyfile(solid_file, solid_file_gz)
-        subprocess.run(["gzip", "-f", solid_file_gz], check=True)
-        processed += 1
+        stages.append(Stage("solid", make_solid, (gen_code, solid_inputs[0], solid_file, opts),
+                            solid_inputs, [ solid_file ], cpu=True, shared=not is_solid))
+        stages.append(Stage("solid archive", copy_and_compress, (solid_file, None, solid_file_gz + ext, codec),
+                            [ solid_file ], [ solid_file_gz + ext ]))
+        records.append((solid_file, solid_inputs, solid_opts, SOLID_TOOLS, [ "solid", "solid archive" ]))
+
+    lods = []
+    for name, target_size, lod_file, lod_file_gz in (("medium", SURFACE_MED_TARGET_SIZE, surface_med_file, surface_med_file_gz),
+                                                     ("low", SURFACE_LOW_TARGET_SIZE, surface_low_file, surface_low_file_gz)):
+        if force or not state.is_current(lod_file, [ surface ], lod_opts, [ lod_file, lod_file_gz + ext ], LOD_TOOLS):
+            print("process %s surface %s" % (name, lod_file))
+            lods.append((name, target_size, lod_file, lod_file_gz))
+
+    groups = [ lods ] if lods and opts['lod_engine'] == "qem" else [ [ lod ] for lod in lods ]
+    # In the stage pool the LOD stages search their segment lengths one at a time. A pool
+    # of remesh workers in each stage worker would nest process pools, each with its own
+    # copy of the surface.
+    if stage_jobs > 1 and len([ stage for stage in stages if stage.cpu ]) + len(groups) > 1:
+        lod_jobs = 1
+    lod_stages = []
+    for group in groups:
+        stage_name = "%s surface" % "+".join([ name for name, target_size, lod_file, lod_file_gz in group ])
+        targets = [ (target_size, lod_file) for name, target_size, lod_file, lod_file_gz in group ]
+        stages.append(Stage(stage_name, make_surface_lods, (surface, targets, opts['lod_engine'], segment_lens, lod_jobs),
+                            [ surface ], [ lod_file for target_size, lod_file in targets ], cpu=True, shared=True))
+        lod_stages.append(stage_name)
+        for name, target_size, lod_file, lod_file_gz in group:
+            stages.append(Stage("%s archive" % name, copy_and_compress, (lod_file, None, lod_file_gz + ext, codec),
+                                [ lod_file ], [ lod_file_gz + ext ]))
+            records.append((lod_file, [ surface ], lod_opts, LOD_TOOLS, [ stage_name, "%s archive" % name ]))
 
-    try:
-        if force or (not os.path.exists(surface_file)) or (not os.path.exists(surface_file_gz + ".gz")):
-            shutil.copyfile(surface, surface_file)
-            shutil.copyfile(surface, surface_file_gz)
-            subprocess.run(["gzip", "-f", surface_file_gz], check=True)
-            processed += 1
-
-        if force or (not os.path.exists(manifest_file) or not os.path.exists(manifest_file_git)):
-            shutil.copyfile(manifest, manifest_file)
-            shutil.copyfile(manifest_file, manifest_file_git)
-            processed += 1
+    # Now do stuff!
+    results, timings, failed = run_stages(stages, stage_jobs, ARCHIVE_THREADS, surface)
 
-        if force or (not os.path.exists(surface_med_file)) or (not os.path.exists(surface_med_file_gz + ".gz")):
-            print("process medium surface %s" % surface_med_file)
-            downsample_mesh(False, SURFACE_MED_TARGET_SIZE, surface, surface_med_file)
-            shutil.copyfile(surface_med_file, surface_med_file_gz)
-            subprocess.run(["gzip", "-f", surface_med_file_gz], check=True)
-            processed += 1
+    for stage_name in lod_stages:
+        for target_size, segment_len in results.get(stage_name, {}).items():
+            if segment_len:
+                save_segment_len(segment_len_file, target_size, segment_len)
 
-        if force or (not os.path.exists(surface_low_file)) or (not os.path.exists(surface_low_file_gz + ".gz")):
-            print("process low surface %s" % surface_low_file)
-            downsample_mesh(False, SURFACE_LOW_TARGET_SIZE, surface, surface_low_file)
-            shutil.copyfile(surface_low_file, surface_low_file_gz)
-            subprocess.run(["gzip", "-f", surface_low_file_gz], check=True)
+    # an output only counts as built once all of its stages worked
+    for output, inputs, output_opts, tools, needs in records:
+        if all([ stage_name in results for stage_name in needs ]):
+            state.record(output, inputs, output_opts, tools)
             processed += 1
 
-    except subprocess.CalledProcessError as err:
-        print("Cannot copy files to archives: ", str(err))
-        return False
-    except IOError as err:
-        print("Cannot copy files to archives: ", str(err))
+    if failed:
+        print("%s-%s Failed: %s" % (id, code, ", ".join(failed)))
         return False
 
     if not processed:
         print("%s-%s Nothing to process, all up to date." % (id, code))
     else:
         print("%s-%s Processed %d items." % (id, code, processed))
+        for stage in stages:
+            print("  %-20s %7.1fs" % (stage.name, timings[stage.name]))
 
     return True
@@ -0,0 +1,139 @@
+import os
+import tempfile
+import numpy as np
+import pymesh
+from wearebeautiful.decimate import QEMDecimator
+from wearebeautiful import mesh_cache
+
+PROGRESSIVE_FILE = "progressive.npz"
+
+
+class ProgressiveMesh(object):
+    """
+       A full resolution mesh plus the ordered list of edge collapses that decimate it.
+       Collapse i merges vertex v[i] into u[i], moves u[i] to pos[i] and leaves
+       faces_left[i] faces. Any prefix of the collapses is a valid mesh, so a mesh with
+       any face count down to the last entry of faces_left can be extracted without
+       decimating again. The decimator stops at the same collapse when it is run to a
+       face count, so the extracted mesh is the one it would make. min_faces is the face
+       count the collapses were asked to reach.
+    """
+
+    def __init__(self, vertices, faces, u, v, pos, faces_left, min_faces):
+        self.vertices = vertices
+        self.faces = faces
+        self.u = u
+        self.v = v
+        self.pos = pos
+        self.faces_left = faces_left
+        self.min_faces = int(min_faces)
+
+
+    @classmethod
+    def build(cls, mesh, min_faces):
+        """
+           Run the QEM decimator on mesh down to min_faces faces and record the collapses.
+        """
+
+        print("build progressive mesh from %s to %s faces" % (f'{mesh.num_faces:,}', f'{int(min_faces):,}'))
+        decimator = QEMDecimator(mesh.vertices, mesh.faces, record=True)
+        decimator.run(min_faces)
+
+        records = decimator.records
+        u = np.concatenate([ np.zeros(0, dtype=np.int64) ] + [ r[0] for r in records ])
+        v = np.concatenate([ np.zeros(0, dtype=np.int64) ] + [ r[1] for r in records ])
+        pos = np.concatenate([ np.zeros((0, 3), dtype=np.float64) ] + [ r[2] for r in records ])
+        faces_left = np.concatenate([ np.zeros(0, dtype=np.int64) ] + [ r[3] for r in records ])
+
+        return cls(np.array(mesh.vertices, dtype=np.float64), np.array(mesh.faces, dtype=np.int64),
+                   u, v, pos, faces_left, min_faces)
+
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(data['vertices'], data['faces'], data['u'], data['v'], data['pos'], data['faces_left'],
+                       data['min_faces'])
+
+
+    def save(self, filename):
+        with open(filename, "wb") as f:
+            self.save_to(f)
+
+
+    def save_to(self, f):
+        np.savez(f, vertices=self.vertices, faces=self.faces, u=self.u, v=self.v, pos=self.pos,
+                 faces_left=self.faces_left, min_faces=self.min_faces)
+
+
+    def extract(self, target_faces):
+        """
+           Replay the collapses until no more than target_faces faces are left (or the
+           record runs out): every removed vertex is mapped onto the vertex it ended up
+           merged into, the surviving vertices get their last position and the faces
+           that collapsed to an edge are dropped.
+
+           returns the mesh with unused vertices removed
+        """
+
+        if len(self.faces) <= target_faces:
+            count = 0
+        else:
+            count = min(int(np.searchsorted(-self.faces_left, -target_faces)) + 1, len(self.faces_left))
+        u = self.u[:count]
+        v = self.v[:count]
+
+        parent = np.arange(len(self.vertices), dtype=np.int64)
+        parent[v] = u
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+
+        # the last collapse into a vertex decides where it ends up
+        vertices = self.vertices.copy()
+        kept, last = np.unique(u[::-1], return_index=True)
+        vertices[kept] = self.pos[:count][::-1][last]
+
+        faces = parent[self.faces]
+        faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+        used, faces = np.unique(faces, return_inverse=True)
+
+        return pymesh.form_mesh(vertices[used], faces.reshape(-1, 3))
+
+
+def load_progressive_mesh(surface_file, min_faces, mesh=None):
+    """
+       Load the progressive mesh of surface_file from the mesh cache, next to the cached
+       arrays of the surface, so it goes when they are evicted. It is built again (and
+       saved) if it is missing or does not go down to min_faces. If the surface mesh is
+       given, it is used instead of loading surface_file.
+
+       returns the progressive mesh
+    """
+
+    dir = mesh_cache.cache_dir(mesh_cache.mesh_key(surface_file))
+    filename = os.path.join(dir, PROGRESSIVE_FILE)
+    try:
+        pm = ProgressiveMesh.load(filename)
+        if pm.min_faces <= min_faces:
+            return pm
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    if mesh is None:
+        mesh = mesh_cache.load_mesh(surface_file)
+    pm = ProgressiveMesh.build(mesh, min_faces)
+
+    # write to a temp file and rename, so concurrent runs never see a partial file
+    try:
+        os.makedirs(dir, exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(dir=dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pm.save_to(f)
+        os.replace(temp_file, filename)
+    except (IOError, OSError) as err:
+        print("cannot save progressive mesh to %s: %s" % (filename, str(err)))
+
+    return pm
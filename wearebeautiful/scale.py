@@ -1,13 +1,24 @@
 import sys
 import os
 import math
-import tempfile
+import json
 from time import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from wearebeautiful.utils import flip_mesh, center_around_origin
+from wearebeautiful.decimate import decimate_mesh
+from wearebeautiful.stl import save_mesh, STL_HEADER_SIZE, STL_FACE_SIZE
+from wearebeautiful.mesh_cache import load_mesh
 
 import pymesh
 
+MAX_DOWNSAMPLE_TRIES = 10
+MAX_PARALLEL_ROUNDS = 3
+PARALLEL_SPREAD = 1.1
+DOWNSAMPLE_JOBS = min(4, os.cpu_count() or 1)
+LOD_ENGINES = ("remesh", "qem")
+
+
 def fix_mesh(mesh, target_len):
     bbox_min, bbox_max = mesh.bbox;
     diag_len = np.linalg.norm(bbox_max - bbox_min);
@@ -31,71 +42,295 @@ def fix_mesh(mesh, target_len):
     return mesh;
 
 
-def downsample_mesh(invert, target_size, in_file, out_file):
-
-    min_file_size = target_size * .9
-    max_file_size = target_size * 1.1
-
-    file_size = os.path.getsize(in_file)
-    mesh = pymesh.meshio.load_mesh(in_file);
-
-    temp_file = "/tmp/temp.stl"
-    segment_len = .40
-    last_size = None
-    increment = .1
-    if file_size > max_file_size:
-        print("initial size: %sKb, target size: %sKb" % (f'{file_size // 1024:,}', f'{target_size // 1024:,}'))
-        while True:
-            mesh = fix_mesh(mesh, segment_len)
-            pymesh.meshio.save_mesh(temp_file, mesh);
-            new_size = os.path.getsize(temp_file)
-            print("size: %sKb" % (f'{new_size // 1024:,}'))
-
-            if new_size <= max_file_size and new_size >= min_file_size:
-                break
-
-            done = False
-            if last_size:
-                if new_size > max_file_size and last_size < min_file_size:
-                    increment /= 2.0
-                    segment_len += increment
-                    done = True
-                elif new_size < min_file_size and last_size > max_file_size:
-                    increment /= 2.0
-                    segment_len -= increment
-                    done = True
-
-            if not done: 
-                diff = abs(target_size - new_size)
-                if diff > (target_size * 3):
-                    adjust = 3
-                elif diff > (target_size * 2):
-                    adjust = 2
-                else:
-                    adjust = 1
-                if new_size > target_size:
-                    segment_len += (adjust * increment)
-                else:
-                    segment_len -= (adjust * increment)
-
-            mesh = pymesh.meshio.load_mesh(in_file);
-            last_size = new_size
+def stl_size(num_faces):
+    """ A binary STL file has an 84 byte header and 50 bytes per face. """
+    return STL_HEADER_SIZE + STL_FACE_SIZE * num_faces
+
+
+def stl_faces(file_size):
+    return max(0, (file_size - STL_HEADER_SIZE) // STL_FACE_SIZE)
+
+
+def mean_edge_len(mesh):
+    vertices = mesh.vertices
+    faces = mesh.faces
+    return np.mean([ np.linalg.norm(vertices[faces[:, i]] - vertices[faces[:, (i + 1) % 3]], axis=1).mean() for i in range(3) ])
+
+
+def predict_segment_len(samples, target_faces, default_exponent=-2.0):
+    """
+       Fit faces = c * segment_len ^ k through the samples closest to the target face count
+       (in log space) and solve for the segment length that gives target_faces. With a
+       single sample the exponent defaults to -2, since the face count of a remeshed
+       surface goes with its area over the segment length squared.
+    """
+
+    samples = sorted(samples, key=lambda sample: abs(math.log(sample[1] / target_faces)))[:2]
+    (len0, faces0) = samples[0]
+    exponent = default_exponent
+    if len(samples) > 1:
+        (len1, faces1) = samples[1]
+        if len0 != len1 and faces0 != faces1:
+            exponent = math.log(faces1 / faces0) / math.log(len1 / len0)
+            exponent = min(-0.5, max(-4.0, exponent))
+
+    return len0 * math.pow(target_faces / faces0, 1.0 / exponent)
+
+
+def load_segment_lens(state_file):
+    try:
+        with open(state_file, "r") as f:
+            return json.loads(f.read())
+    except (IOError, ValueError):
+        return {}
+
+
+def save_segment_len(state_file, target_size, segment_len):
+    lens = load_segment_lens(state_file)
+    lens[str(target_size)] = segment_len
+    try:
+        with open(state_file, "w") as f:
+            f.write(json.dumps(lens, indent=4, sort_keys=True))
+    except IOError as err:
+        print("cannot save segment len to %s: %s" % (state_file, str(err)))
+
+
+def surface_area(mesh):
+    vertices = mesh.vertices
+    faces = mesh.faces
+    a = vertices[faces[:, 0]]
+    return np.linalg.norm(np.cross(vertices[faces[:, 1]] - a, vertices[faces[:, 2]] - a), axis=1).sum() / 2.0
+
+
+def segment_len_faces(mesh, segment_len):
+    """ returns the number of equilateral triangles with side segment_len that cover the mesh """
+    return int(surface_area(mesh) / (math.sqrt(3.0) / 4.0 * segment_len ** 2))
+
+
+class SegmentLenSearch(object):
+    """
+       Keeps track of the remesh tries of a segment length search: the face count of
+       each try, and the longest length that gave too many faces and the shortest one
+       that gave too few, which bracket the answer.
+    """
+
+    def __init__(self, segment_len, min_faces, max_faces, target_faces):
+        self.segment_len = segment_len
+        self.min_faces = min_faces
+        self.max_faces = max_faces
+        self.target_faces = target_faces
+        self.samples = []
+        self.too_short = 0.0
+        self.too_long = None
+
+
+    def add(self, segment_len, num_faces):
+        """
+           Record a try. returns True if its face count is within the target range.
+        """
+
+        print("size: %sKb (%s faces) at len %.4f" % (f'{stl_size(num_faces) // 1024:,}', f'{num_faces:,}', segment_len))
+        if num_faces >= self.min_faces and num_faces <= self.max_faces:
+            return True
+
+        if num_faces > self.max_faces:
+            self.too_short = max(self.too_short, segment_len)
+        else:
+            self.too_long = segment_len if self.too_long is None else min(self.too_long, segment_len)
+        self.samples.append((segment_len, max(num_faces, 1)))
+
+        return False
+
+
+    def in_bracket(self, segment_len):
+        return segment_len > self.too_short and (self.too_long is None or segment_len < self.too_long)
+
+
+    def next(self):
+        """
+           returns the best guess for the next try
+        """
+
+        segment_len = predict_segment_len(self.samples, self.target_faces)
+        if not self.in_bracket(segment_len):
+            if self.too_long is None:
+                segment_len = self.too_short * 2.0
+            else:
+                segment_len = (self.too_short + self.too_long) / 2.0
+
+        return segment_len
+
 
+    def error(self, num_faces):
+        return abs(math.log(max(num_faces, 1) / self.target_faces))
+
+
+def search_serial(search, original):
+    """
+       Try one segment length after the other, each picked from the previous tries.
+
+       returns the remeshed mesh and its segment length
+    """
+
+    segment_len = search.segment_len
+    for i in range(MAX_DOWNSAMPLE_TRIES):
+        mesh = fix_mesh(original, segment_len)
+        if search.add(segment_len, mesh.num_faces):
+            break
+        segment_len = search.next()
+    else:
+        print("segment len search did not converge, using the last try.")
+
+    return mesh, segment_len
+
+
+def remesh_candidate(source, segment_len):
+    """
+       Remesh the mesh handed out by search_parallel, this runs in a worker process.
+       source is the descriptor of the shared arrays or, without shared memory, the
+       (vertices, faces) arrays themselves.
+
+       returns segment_len and the vertices and faces of the result
+    """
+
+    if isinstance(source, tuple):
+        mesh = fix_mesh(pymesh.form_mesh(*source), segment_len)
+    else:
+        from wearebeautiful.shm import SharedArrays
+
+        shared = SharedArrays.attach(source)
+        try:
+            mesh = fix_mesh(pymesh.form_mesh(shared.arrays['vertices'], shared.arrays['faces']), segment_len)
+        finally:
+            shared.close()
+
+    return segment_len, mesh.vertices, mesh.faces
+
+
+def search_parallel(search, original, jobs):
+    """
+       Try jobs segment lengths at once in a process pool, spread around the best guess.
+       The input mesh goes to the workers in shared memory if the Python version has
+       it, otherwise the arrays are pickled for every try. The first round spreads the
+       lengths by PARALLEL_SPREAD, which usually brackets the target. Later rounds use a
+       much smaller spread around the length predicted from all tries so far.
+
+       returns the remeshed mesh and its segment length
+    """
+
+    # imported here, so the serial path never depends on it
+    from wearebeautiful.shm import SharedArrays, SHARED_MEMORY_AVAILABLE
+
+    if SHARED_MEMORY_AVAILABLE:
+        shared = SharedArrays.create(vertices=original.vertices, faces=original.faces)
+        source = shared.descriptor
+    else:
+        shared = None
+        source = (np.asarray(original.vertices), np.asarray(original.faces))
+
+    best = None
+    spread = PARALLEL_SPREAD
+    segment_len = search.segment_len
     try:
-        os.unlink(temp_file)
-    except IOError:
-        pass
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for round in range(MAX_PARALLEL_ROUNDS):
+                # the best guess first, then alternating shorter and longer ones
+                steps = [ (i + 1) // 2 * (1 if i % 2 else -1) for i in range(jobs) ]
+                candidates = [ c for c in [ segment_len * spread ** step for step in steps ] if search.in_bracket(c) ]
+                if not candidates:
+                    candidates = [ segment_len ]
+
+                converged = False
+                for length, vertices, faces in pool.map(remesh_candidate, [ source ] * len(candidates), candidates):
+                    converged = search.add(length, len(faces)) or converged
+                    if best is None or search.error(len(faces)) < search.error(len(best[2])):
+                        best = (length, vertices, faces)
+
+                if converged:
+                    break
+                segment_len = search.next()
+                spread = PARALLEL_SPREAD ** (1.0 / (4 * (round + 1)))
+            else:
+                print("segment len search did not converge, using the closest try.")
+    finally:
+        if shared:
+            shared.unlink()
+
+    return pymesh.form_mesh(best[1], best[2]), best[0]
+
+
+def downsample_mesh(invert, target_size, in_file, out_file, segment_len=None, engine="remesh", jobs=1, mesh=None):
+    """
+       Downsample in_file so that out_file ends up within 10% of target_size bytes as a
+       binary STL.
+
+       The "qem" engine decimates straight to the face budget in one pass. The "remesh"
+       engine searches for the remesh segment length: the search works on face counts,
+       keeps the input mesh in memory and picks each new segment length from a power
+       law fitted to the previous tries.
+
+       segment_len is the first length to try, usually the one that converged the last
+       time this model was processed. If it is not given, it is estimated from the mean
+       edge length of the input. With jobs > 1 the remesh engine tries that many
+       lengths at once. If mesh is given, it is used instead of loading in_file.
+
+       returns the segment length to start from next time or None if no downsampling
+       was needed or the qem engine was used
+    """
+
+    min_faces = stl_faces(target_size * .9)
+    max_faces = stl_faces(target_size * 1.1)
+    target_faces = stl_faces(target_size)
+
+    original = load_mesh(in_file) if mesh is None else mesh
+    mesh = original
+
+    if original.num_faces <= max_faces:
+        segment_len = None
+    elif engine == "qem":
+        print("initial size: %sKb, target size: %sKb" % (f'{stl_size(original.num_faces) // 1024:,}', f'{target_size // 1024:,}'))
+        mesh = decimate_mesh(original, target_faces)
+        segment_len = None
+    else:
+        print("initial size: %sKb, target size: %sKb" % (f'{stl_size(original.num_faces) // 1024:,}', f'{target_size // 1024:,}'))
+        if not segment_len:
+            segment_len = predict_segment_len([(mean_edge_len(original), original.num_faces)], target_faces)
+
+        search = SegmentLenSearch(segment_len, min_faces, max_faces, target_faces)
+        if jobs > 1:
+            mesh, segment_len = search_parallel(search, original, jobs)
+        else:
+            mesh, segment_len = search_serial(search, original)
+
+    save_lod(mesh, out_file)
+
+    return segment_len
+
+
+def extract_lod(pm, target_size, out_file):
+    """
+       Write the level of detail of the progressive mesh pm that fits in target_size
+       bytes as a binary STL.
+    """
+
+    print("extract %sKb from progressive mesh" % f'{target_size // 1024:,}')
+    save_lod(pm.extract(stl_faces(target_size)), out_file)
+
 
+def save_lod(mesh, out_file):
     mesh, __ = pymesh.remove_degenerated_triangles(mesh, 100);
     mesh = center_around_origin(mesh)
-    pymesh.meshio.save_mesh(out_file, mesh);
+    save_mesh(out_file, mesh);
 
 
-def scale_mesh(invert, len, in_file, out_file):
+def scale_mesh(invert, len, in_file, out_file, engine="remesh"):
 
-    mesh = pymesh.meshio.load_mesh(in_file);
+    mesh = load_mesh(in_file);
 
-    mesh = fix_mesh(mesh, len);
+    if engine == "qem":
+        mesh = decimate_mesh(mesh, segment_len_faces(mesh, len))
+    else:
+        mesh = fix_mesh(mesh, len);
     mesh, __ = pymesh.remove_degenerated_triangles(mesh, 100);
     mesh = center_around_origin(mesh)
 
@@ -107,4 +342,4 @@ def scale_mesh(invert, len, in_file, out_file):
         mesh = flip_mesh(mesh)
         print(" flip: %d vertexes, %d faces." % (mesh.num_vertices, mesh.num_faces))
 
-    pymesh.meshio.save_mesh(out_file, mesh);
+    save_mesh(out_file, mesh);
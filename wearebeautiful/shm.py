@@ -0,0 +1,88 @@
+import numpy as np
+
+# multiprocessing.shared_memory only exists from Python 3.8 on, the pymesh image ships
+# an older one. Users of SharedArrays check SHARED_MEMORY_AVAILABLE and do without.
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+SHARED_MEMORY_AVAILABLE = shared_memory is not None
+
+
+class SharedArrays(object):
+    """
+       A set of named numpy arrays in shared memory, so worker processes can use them
+       without the arrays getting pickled. The process that creates them owns the
+       memory and has to unlink it. Workers attach with the (picklable) descriptor:
+
+           shared = SharedArrays.create(vertices=mesh.vertices, faces=mesh.faces)
+           pool.submit(work, shared.descriptor)
+           ...
+           shared.unlink()
+
+       and in the worker:
+
+           shared = SharedArrays.attach(descriptor)
+           vertices = shared.arrays['vertices']
+           ...
+           shared.close()
+    """
+
+    def __init__(self, blocks, descriptor, owner):
+        self.blocks = blocks
+        self.descriptor = descriptor
+        self.owner = owner
+        self.arrays = {}
+        for name, (block_name, shape, dtype) in descriptor.items():
+            self.arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=blocks[name].buf)
+
+
+    @classmethod
+    def create(cls, **arrays):
+        blocks = {}
+        descriptor = {}
+        try:
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+                blocks[name] = block
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+                descriptor[name] = (block.name, array.shape, array.dtype.str)
+        except Exception:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+            raise
+
+        return cls(blocks, descriptor, True)
+
+
+    @classmethod
+    def attach(cls, descriptor):
+        blocks = {}
+        for name, (block_name, shape, dtype) in descriptor.items():
+            blocks[name] = shared_memory.SharedMemory(name=block_name)
+
+        return cls(blocks, descriptor, False)
+
+
+    def close(self):
+        """
+           Detach from the shared memory. The arrays can't be used afterwards.
+        """
+
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+
+
+    def unlink(self):
+        """
+           Detach and free the shared memory, only the process that created it does this.
+        """
+
+        self.close()
+        if self.owner:
+            for block in self.blocks.values():
+                block.unlink()
@@ -5,12 +5,17 @@ import shutil
 from time import time
 import numpy as np
 from math import fabs, pow, sqrt
-from wearebeautiful.utils import rotate, scale, translate, get_fast_bbox, make_3d, center_around_origin, save_mesh, flip_mesh
+from wearebeautiful.utils import translate, get_fast_bbox, make_3d, center_around_origin, save_mesh, flip_mesh
 from wearebeautiful.extrude import simple_extrude
-import subprocess
-from pylab import imread
+from wearebeautiful.transform import Transform
+from wearebeautiful.label_cache import label_key, load_label_mesh, save_label_mesh
+from wearebeautiful import csg
+from wearebeautiful import stl
+from wearebeautiful import mesh_cache
+from wearebeautiful.clip import clip_mesh_to_box, subtract_locally
+from wearebeautiful.glyphs import make_vector_text_mesh, GLYPH_CURVE_STEPS
 from scipy.ndimage import gaussian_filter
-from stl_tools import numpy2stl
+from PIL import Image, ImageDraw, ImageFont
 
 import pymesh
 
@@ -26,82 +31,159 @@ HOOK_BOX_DEPTH = 10
 LARGE_TEXT_WIDTH = 540
 SMALL_TEXT_WIDTH = 470
 TEXT_HEIGHT = 70
-FONT_FILE = "font/d-din.ttf"
-IMAGE_FILE = "/tmp/text.png"
-TEXT_STL_FILE = "/tmp/text.stl"
+TEXT_POINT_SIZE = 64
+TEXT_ORIGIN = (10, 60)
+TEXT_BLUR_SIGMA = 1
+TEXT_HEIGHT_SCALE = 0.25
+TEXT_MASK_VAL = 1
+FONT_FILE = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "font", "d-din.ttf"))
 
 
 def make_text_image(text, large=False):
+    """
+       Render text with the bundled font into a greyscale image.
+
+       returns the image as a float array with values between 0.0 and 1.0
+    """
 
     if large:
-        size = "%dx%d" % (LARGE_TEXT_WIDTH, TEXT_HEIGHT)
+        size = (LARGE_TEXT_WIDTH, TEXT_HEIGHT)
     else:
-        size = "%dx%d" % (SMALL_TEXT_WIDTH, TEXT_HEIGHT)
-
-    try:
-        subprocess.run(["convert", "-size",  size, "xc:black", "/tmp/black.png"], check=True)
-    except subprocess.CalledProcessError as err:
-        print(str(err))
-        sys.exit(-1)
+        size = (SMALL_TEXT_WIDTH, TEXT_HEIGHT)
 
     try:
-        subprocess.run(["convert", "-pointsize", "64", "-font", FONT_FILE, "-fill", "white", "-draw", 
-            'text 10,60 "%s"' % text, "/tmp/black.png", IMAGE_FILE], check=True)
-    except subprocess.CalledProcessError as err:
-        print(str(err))
+        font = ImageFont.truetype(FONT_FILE, TEXT_POINT_SIZE)
+    except IOError as err:
+        print("cannot load font %s: %s" % (FONT_FILE, str(err)))
         sys.exit(-1)
 
-    os.unlink("/tmp/black.png")
-
-    return IMAGE_FILE
-
-
-def make_stl_from_image(image_file):
-
-    A = 256 * imread(image_file)
-    A = gaussian_filter(A, 1)
-    numpy2stl(A, TEXT_STL_FILE, scale=0.25, mask_val=1, solid=True)
-
-    return TEXT_STL_FILE
-
-
-def make_text_mesh(text, large):
-
-    image = make_text_image(text, large)
+    # The origin is the left end of the text baseline, the same as ImageMagick's -draw text
+    image = Image.new("L", size, 0)
+    ImageDraw.Draw(image).text(TEXT_ORIGIN, text, fill=255, font=font, anchor="ls")
+
+    return np.asarray(image, dtype=np.float64) / 255.0
+
+
+def make_heightfield_mesh(image):
+    """
+       Turn a text image into a solid heightfield mesh, in memory. This builds the same
+       geometry that numpy2stl(..., solid=True) wrote out: the grid is rotated so the long
+       side runs along x, only pixels above TEXT_MASK_VAL get triangles, the edge of the
+       masked area is pulled down to the floor and a mirrored floor closes the bottom.
+
+       returns vertices, faces arrays
+    """
+
+    A = gaussian_filter(256 * image, TEXT_BLUR_SIGMA)
+    m, n = A.shape
+    if n >= m:
+        A = np.rot90(A, k=3)
+        m, n = n, m
+    A = TEXT_HEIGHT_SCALE * (A - A.min())
+
+    above = A > TEXT_MASK_VAL
+    this_pt, top_right = above[:-1, :-1], above[:-1, 1:]
+    bottom_left, bottom_right = above[1:, :-1], above[1:, 1:]
+    upper = this_pt & top_right & bottom_left
+    lower = this_pt & bottom_right & bottom_left
+
+    idx = np.arange(m * n).reshape(m, n)
+    faces = np.concatenate((np.column_stack((idx[:-1, 1:][upper], idx[:-1, :-1][upper], idx[1:, 1:][upper])),
+                            np.column_stack((idx[1:, 1:][lower], idx[:-1, :-1][lower], idx[1:, :-1][lower]))))
+    if len(faces) == 0:
+        return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int32)
+
+    mask = np.zeros((m, n), dtype=bool)
+    mask[:-1, :-1] |= upper | lower
+    mask[:-1, 1:] |= upper
+    mask[1:, :-1] |= upper | lower
+    mask[1:, 1:] |= lower
+
+    # points that do not have a fully masked neighbourhood, plus the image border, are edges
+    neighbours = sum([ np.roll(mask, (i, k), axis=(0, 1)).astype(np.int32) for i in (-1, 0, 1) for k in (-1, 0, 1) ])
+    edge = (neighbours > 0) & (neighbours < 9)
+    edge[0::m - 1, :] = True
+    edge[:, 0::n - 1] = True
+
+    zvals = A.ravel()[faces]
+    floor = zvals.min() - 0.1 * np.ptp(zvals)
+
+    xs, ys = np.meshgrid(np.arange(m) - m / 2.0, np.arange(n) - n / 2.0, indexing="ij")
+    vertices = np.empty((2 * m * n, 3), dtype=np.float64)
+    vertices[:m * n, 0] = vertices[m * n:, 0] = xs.ravel()
+    vertices[:m * n, 1] = vertices[m * n:, 1] = ys.ravel()
+    vertices[:m * n, 2] = A.ravel()
+    vertices[m * n:, 2] = floor
+
+    # edge points sit on the floor, so they share the floor vertex
+    top = np.where(edge.ravel(), idx.ravel() + m * n, idx.ravel())
+    faces = np.concatenate((top[faces], faces[:, [1, 0, 2]] + m * n))
+
+    used, faces = np.unique(faces, return_inverse=True)
+    return vertices[used], faces.reshape(-1, 3).astype(np.int32)
+
+
+def text_render_params():
+    """
+       Everything besides the text, size class and font that changes how a label comes out.
+    """
+    return {
+        'renderer' : 'pillow-heightfield',
+        'width' : [SMALL_TEXT_WIDTH, LARGE_TEXT_WIDTH],
+        'height' : TEXT_HEIGHT,
+        'point_size' : TEXT_POINT_SIZE,
+        'origin' : TEXT_ORIGIN,
+        'blur_sigma' : TEXT_BLUR_SIGMA,
+        'height_scale' : TEXT_HEIGHT_SCALE,
+        'mask_val' : TEXT_MASK_VAL,
+    }
+
+
+def vector_text_render_params(opts):
+    """
+       Everything besides the text, size class and font that changes how a vector label comes out.
+    """
+    return {
+        'renderer' : 'vector-outline',
+        'curve_steps' : GLYPH_CURVE_STEPS,
+        'depth' : 2 * opts['text_depth'],
+    }
+
+
+def make_text_mesh(text, large, opts):
+    """
+       Make the mesh for a label, either as a raster heightfield or, if opts['vector_labels']
+       is set, from the glyph outlines. Vector labels are extruded to twice the text depth,
+       so that they stick out text_depth from the frame and are buried as deep in it.
+    """
+
+    if opts['vector_labels']:
+        key = label_key(text, large, FONT_FILE, vector_text_render_params(opts))
+    else:
+        key = label_key(text, large, FONT_FILE, text_render_params())
+    mesh = load_label_mesh(key)
+    if mesh is not None:
+        return mesh
 
-    stl = make_stl_from_image(image)
-    os.unlink(image)
+    if opts['vector_labels']:
+        vertices, faces = make_vector_text_mesh(text, FONT_FILE, 2 * opts['text_depth'])
+    else:
+        vertices, faces = make_heightfield_mesh(make_text_image(text, large))
+    mesh = pymesh.form_mesh(vertices, faces)
 
-    text = pymesh.meshio.load_mesh(stl)
-    os.unlink(stl)
+    save_label_mesh(key, mesh)
 
-    return text
+    return mesh
 
 
 def move_text_to_surface(text, inner_box_dims, side, opts, text_scale, horiz_offset, vert_offset):
 
-    text = center_around_origin(text)
+    xform = Transform(text).center_around_origin()
 
-    ubox = get_fast_bbox(text)
+    ubox = xform.bbox()
     text_w = ubox[1][0] - ubox[0][0]
     text_h = ubox[1][1] - ubox[0][1]
 
-    if side == 'left':
-        text = rotate(text, (0,0,0), (0, 1, 0), -90)
-        text = rotate(text, (0,0,0), (1, 0, 0), 180)
-    elif side == 'right':
-        text = rotate(text, (0,0,0), (0, 1, 0), -90)
-        text = rotate(text, (0,0,0), (0, 0, 1), 180)
-        text = rotate(text, (0,0,0), (1, 0, 0), 180)
-    elif side == 'bottom':
-        text = rotate(text, (0,0,0), (0, 1, 0), 90)
-        text = rotate(text, (0,0,0), (0, 0, 1), -90)
-    elif side == 'top':
-        text = rotate(text, (0,0,0), (0, 1, 0), 90)
-        text = rotate(text, (0,0,0), (0, 0, 1), 90)
-    elif side == 'floor':
-        text = rotate(text, (0,0,0), (0, 1, 0), 180)
-
     if side == 'bottom' or side == 'top':
         box_w = inner_box_dims[1][1] - inner_box_dims[0][1]
     elif side == 'left' or side == 'right':
@@ -110,10 +192,31 @@ def move_text_to_surface(text, inner_box_dims, side, opts, text_scale, horiz_off
         box_w = inner_box_dims[1][2] - inner_box_dims[0][2]
         
 
+    # The text is centered, so scaling before rotating gives the same result. Vector labels
+    # are already extruded to their final depth, so only their outline gets scaled.
     scale_f = (box_w * text_scale)  / text_w
-    text = scale(text, (scale_f, scale_f, scale_f))
+    if opts['vector_labels']:
+        xform.scale((scale_f, scale_f, 1.0))
+    else:
+        xform.scale((scale_f, scale_f, scale_f))
 
-    ubox = get_fast_bbox(text)
+    if side == 'left':
+        xform.rotate((0,0,0), (0, 1, 0), -90)
+        xform.rotate((0,0,0), (1, 0, 0), 180)
+    elif side == 'right':
+        xform.rotate((0,0,0), (0, 1, 0), -90)
+        xform.rotate((0,0,0), (0, 0, 1), 180)
+        xform.rotate((0,0,0), (1, 0, 0), 180)
+    elif side == 'bottom':
+        xform.rotate((0,0,0), (0, 1, 0), 90)
+        xform.rotate((0,0,0), (0, 0, 1), -90)
+    elif side == 'top':
+        xform.rotate((0,0,0), (0, 1, 0), 90)
+        xform.rotate((0,0,0), (0, 0, 1), 90)
+    elif side == 'floor':
+        xform.rotate((0,0,0), (0, 1, 0), 180)
+
+    ubox = xform.bbox()
     trans_x = trans_y = trans_z = 0.0
 
     if side == 'left':
@@ -138,7 +241,53 @@ def move_text_to_surface(text, inner_box_dims, side, opts, text_scale, horiz_off
         trans_x -= vert_offset
 
 
-    return translate(text, (trans_x,trans_y,trans_z))
+    return xform.translate((trans_x,trans_y,trans_z)).apply()
+
+
+def make_frame_mesh(inner_box_dims, outer_box_dims):
+    """
+       Build the frame directly: the outer box with the inner box cut out of it. The top of
+       the inner box is flush with the top of the outer box, so the result is a tray that
+       is open at the top. This is what the box minus box boolean gave us, but exactly
+       watertight and with 16 vertices and 28 faces.
+
+       returns the frame mesh
+    """
+
+    (x0, y0, z0), (x1, y1, z1) = outer_box_dims
+    (ix0, iy0, iz0), (ix1, iy1, iz1) = inner_box_dims
+
+    # each ring runs counter clockwise seen from above
+    vertices = np.array([(x0, y0, z0), (x1, y0, z0), (x1, y1, z0), (x0, y1, z0),
+                         (x0, y0, z1), (x1, y0, z1), (x1, y1, z1), (x0, y1, z1),
+                         (ix0, iy0, iz0), (ix1, iy0, iz0), (ix1, iy1, iz0), (ix0, iy1, iz0),
+                         (ix0, iy0, z1), (ix1, iy0, z1), (ix1, iy1, z1), (ix0, iy1, z1)], dtype=np.float64)
+
+    faces = [(0, 2, 1), (0, 3, 2), (8, 9, 10), (8, 10, 11)]
+    for i in range(4):
+        j = (i + 1) % 4
+        # outside walls
+        faces.append((i, j, j + 4))
+        faces.append((i, j + 4, i + 4))
+        # top rim
+        faces.append((i + 4, j + 4, j + 12))
+        faces.append((i + 4, j + 12, i + 12))
+        # inside walls, facing into the tray
+        faces.append((i + 8, j + 12, j + 8))
+        faces.append((i + 8, i + 12, j + 12))
+
+    return pymesh.form_mesh(vertices, np.array(faces))
+
+
+def mesh_inside_box(mesh_bbox, box):
+    """
+       returns True if mesh_bbox lies inside box. x and y have to be strictly inside, the
+       mesh may touch the top and the bottom of the box.
+    """
+
+    return mesh_bbox[0][0] > box[0][0] and mesh_bbox[1][0] < box[1][0] and \
+           mesh_bbox[0][1] > box[0][1] and mesh_bbox[1][1] < box[1][1] and \
+           mesh_bbox[0][2] >= box[0][2] and mesh_bbox[1][2] <= box[1][2]
 
 
 def make_solid_main(mesh, opts):
@@ -149,6 +298,8 @@ def make_solid_main(mesh, opts):
     surface_height = (bbox[1][2] - bbox[0][2])
     extrude_mm = surface_height + opts['extrude']
     mesh = simple_extrude(mesh, opts, extrude_mm)
+    if mesh is None:
+        return None, surface_height
     mesh = center_around_origin(mesh)
     if opts['debug']:
         save_mesh("extruded", mesh);
@@ -178,7 +329,6 @@ def modify_solid(mesh, surface_height, code, opts):
 
     inner_box_dims = copy.deepcopy(bbox)
 
-    inner_box = pymesh.generate_box_mesh(bbox[0], bbox[1])
     bbox[0][0] -= OUTER_BOX_MM
     bbox[0][1] -= OUTER_BOX_MM
     bbox[0][2] -= OUTER_BOX_MM
@@ -192,8 +342,7 @@ def modify_solid(mesh, surface_height, code, opts):
 
 
     print("make modifications")
-    outer_box = pymesh.generate_box_mesh(bbox[0], bbox[1])
-    outer_box = pymesh.boolean(outer_box, inner_box, operation="difference", engine="igl")
+    outer_box = make_frame_mesh(inner_box_dims, bbox)
 
     magnet_center = (inner_box_dims[0][0] + (inner_box_dims[1][0] - inner_box_dims[0][0]) / 2.0, 
                      inner_box_dims[0][1] + (inner_box_dims[1][1] - inner_box_dims[0][1]) / 2.0,
@@ -242,30 +391,42 @@ def modify_solid(mesh, surface_height, code, opts):
     elif opts['code_floor']:
         code_side = 'floor';
 
+    labels = []
     if not opts['no_url']:
         print("make url")
-        url = make_text_mesh("wearebeautiful.info", True)
+        url = make_text_mesh("wearebeautiful.info", True, opts)
         url = move_text_to_surface(url, inner_box_dims, url_side, opts, opts['url_scale'], opts['url_h_offset'], opts['url_v_offset'])
-        outer_box = pymesh.boolean(outer_box, url, operation="union", engine="igl")
+        labels.append(csg.leaf("url", url))
 
     if not opts['no_code']:
         print("make code")
-        code = make_text_mesh(code, False)
+        code = make_text_mesh(code, False, opts)
         code = move_text_to_surface(code, inner_box_dims, code_side, opts, opts['code_scale'], opts['code_h_offset'], opts['code_v_offset'])
-        outer_box = pymesh.boolean(outer_box, code, operation="union", engine="igl")
+        labels.append(csg.leaf("code", code))
 
-    if opts['debug']:
-        save_mesh("before-subtract-outer-box", outer_box);
-
-    print("final subtract")
     if surface_height:
         mesh = translate(mesh, (0, 0, -surface_height))
-    if opts['debug']:
-        save_mesh("before-subtract-mesh", mesh);
-    return pymesh.boolean(mesh, outer_box, operation="difference", engine="igl")
+
+    # If the surface sits completely inside the frame, subtracting the frame is the same as
+    # cutting the surface along the walls and floor of the inner box. Only the labels then
+    # still need a boolean, and only on the part of the surface next to each label.
+    if mesh_inside_box(get_fast_bbox(mesh), bbox):
+        print("clip to inner box")
+        mesh = clip_mesh_to_box(mesh, [(0, inner_box_dims[0][0], True), (0, inner_box_dims[1][0], False),
+                                       (1, inner_box_dims[0][1], True), (1, inner_box_dims[1][1], False),
+                                       (2, inner_box_dims[0][2], True)])
+        if labels:
+            print("subtract labels")
+        return subtract_locally(mesh, labels, debug=opts['debug'])
+
+    print("final subtract")
+    plan = csg.difference("solid", csg.leaf("before-subtract-mesh", mesh),
+                          csg.union("before-subtract-outer-box", csg.leaf("frame", outer_box), *labels))
+
+    return csg.evaluate(plan, debug=opts['debug'])
 
 
-def make_solid(code, src_file, dest_file, opts):
+def make_solid(code, src_file, dest_file, opts, mesh=None):
     if opts['debug']:
         try:
             shutil.rmtree("debug")
@@ -292,9 +453,12 @@ def make_solid(code, src_file, dest_file, opts):
     if not opts['code_top'] and not opts['code_bottom'] and not opts['code_left'] and not opts['code_right'] and not opts['code_floor']:
         opts['code_right'] = True
 
-    mesh = pymesh.meshio.load_mesh(src_file);
+    if mesh is None:
+        mesh = mesh_cache.load_mesh(src_file);
     if not opts['solid']:
         mesh, surface_height = make_solid_main(mesh, opts)
+        if mesh is None:
+            return False
     else:
         mesh = center_around_origin(mesh)
         surface_height = 0
@@ -302,6 +466,6 @@ def make_solid(code, src_file, dest_file, opts):
     mesh = modify_solid(mesh, surface_height, code, opts)
     mesh = center_around_origin(mesh)
     print("writing %s" % dest_file)
-    pymesh.meshio.save_mesh(dest_file, mesh);
+    stl.save_mesh(dest_file, mesh);
 
     return True
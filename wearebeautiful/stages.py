@@ -0,0 +1,148 @@
+from time import time
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import pymesh
+from wearebeautiful.mesh_cache import load_mesh_arrays, load_cached_arrays, mesh_key
+
+
+class Stage(object):
+    """
+       One step of building a model: func(*args) reads the files in inputs and writes
+       the files in outputs. A stage starts once every stage that writes one of its
+       inputs has finished. cpu stages run in a process pool, the others (copying and
+       compressing files) in a thread pool. A shared cpu stage is called with the mesh
+       of the source file as mesh=, loaded once for all stages: into shared memory, or if
+       the Python version has none into the mesh cache, which the workers map.
+
+       A stage fails if func raises or returns False.
+    """
+
+    def __init__(self, name, func, args, inputs, outputs, cpu=False, shared=False):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.inputs = inputs
+        self.outputs = outputs
+        self.cpu = cpu
+        self.shared = shared
+
+
+def run_stage(func, args, source):
+    """
+       Run func(*args). With a source func gets the mesh of the source file: source is
+       the descriptor of the shared source arrays or the mesh cache key of the source
+       file, whose cached arrays are memory mapped.
+
+       returns the result and the time it took
+    """
+
+    start = time()
+    if source is None:
+        return func(*args), time() - start
+
+    if isinstance(source, str):
+        arrays = load_cached_arrays(source)
+        if arrays is None:
+            return func(*args), time() - start
+        return func(*args, mesh=pymesh.form_mesh(*arrays)), time() - start
+
+    from wearebeautiful.shm import SharedArrays
+
+    shared = SharedArrays.attach(source)
+    try:
+        mesh = pymesh.form_mesh(shared.arrays['vertices'], shared.arrays['faces'])
+        return func(*args, mesh=mesh), time() - start
+    finally:
+        shared.close()
+
+
+def run_stages(stages, cpu_jobs, io_jobs, source=None):
+    """
+       Run the stages in the order their inputs allow. With cpu_jobs <= 1, or just one
+       cpu stage, the cpu stages run one at a time in this process, while the io stages
+       keep going in the background. Stages that depend on a failed stage are skipped.
+
+       returns a dict of the results and a dict of the times of the stages that worked
+       by name, and the list of the names of the stages that failed or were skipped
+    """
+
+    made_by = { output : stage.name for stage in stages for output in stage.outputs }
+    pending = list(stages)
+    running = {}
+    results = {}
+    timings = {}
+    failed = []
+    shared = None
+    shared_source = None
+
+    # imported here, like in scale.py, so importing this module never touches shared memory
+    from wearebeautiful.shm import SharedArrays, SHARED_MEMORY_AVAILABLE
+
+    cpu_stages = len([ stage for stage in stages if stage.cpu ])
+    cpu_pool = None
+    io_pool = ThreadPoolExecutor(max_workers=io_jobs)
+    try:
+        if cpu_jobs > 1 and cpu_stages > 1:
+            # The source goes into shared memory before the workers are forked. Workers
+            # forked earlier would start their own resource tracker, which frees the
+            # shared memory they attached to when they exit.
+            if source and any([ stage.cpu and stage.shared for stage in stages ]):
+                vertices, faces = load_mesh_arrays(source)
+                if SHARED_MEMORY_AVAILABLE:
+                    shared = SharedArrays.create(vertices=vertices, faces=faces)
+                    shared_source = shared.descriptor
+                else:
+                    shared_source = mesh_key(source)
+            cpu_pool = ProcessPoolExecutor(max_workers=min(cpu_jobs, cpu_stages))
+
+        while pending or running:
+            for stage in list(pending):
+                deps = set([ made_by[f] for f in stage.inputs if f in made_by ])
+                if deps & set(failed):
+                    print("skip %s, it depends on a stage that failed" % stage.name)
+                    pending.remove(stage)
+                    failed.append(stage.name)
+                elif deps <= set(results):
+                    pending.remove(stage)
+                    if not stage.cpu:
+                        future = io_pool.submit(run_stage, stage.func, stage.args, None)
+                    elif cpu_pool:
+                        future = cpu_pool.submit(run_stage, stage.func, stage.args,
+                                                 shared_source if stage.shared else None)
+                    else:
+                        future = Future()
+                        try:
+                            future.set_result(run_stage(stage.func, stage.args, None))
+                        except Exception as err:
+                            future.set_exception(err)
+                    running[future] = stage
+                    # let the stages waiting for this one start before the next one blocks
+                    if stage.cpu and not cpu_pool:
+                        break
+
+            if not running:
+                if pending:
+                    raise ValueError("stages %s wait for each other" % ", ".join([ stage.name for stage in pending ]))
+                break
+
+            done, __ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    result, seconds = future.result()
+                except Exception as err:
+                    print("%s failed: %s" % (stage.name, str(err)))
+                    failed.append(stage.name)
+                    continue
+                if result is False:
+                    failed.append(stage.name)
+                    continue
+                results[stage.name] = result
+                timings[stage.name] = seconds
+    finally:
+        io_pool.shutdown()
+        if cpu_pool:
+            cpu_pool.shutdown()
+        if shared:
+            shared.unlink()
+
+    return results, timings, failed
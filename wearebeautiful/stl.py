@@ -0,0 +1,191 @@
+import os
+import numpy as np
+import pymesh
+
+STL_HEADER_SIZE = 84
+STL_FACE_DTYPE = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attr', '<u2')])
+STL_FACE_SIZE = STL_FACE_DTYPE.itemsize
+STL_HEADER = b"binary STL written by wearebeautiful"
+
+# Faces per chunk of the out of core transforms, about 50MB
+STL_CHUNK_FACES = 1024 * 1024
+
+# Corners closer than this (in mm, per axis) are welded into one vertex
+STL_WELD_QUANTUM = 1e-6
+
+
+def binary_stl_faces(filename):
+    """
+       returns the number of faces if filename is a binary STL file, None otherwise
+    """
+
+    if not filename.lower().endswith(".stl"):
+        return None
+
+    try:
+        size = os.path.getsize(filename)
+        with open(filename, "rb") as f:
+            header = f.read(STL_HEADER_SIZE)
+    except (IOError, OSError):
+        return None
+
+    if len(header) != STL_HEADER_SIZE:
+        return None
+
+    num_faces = int(np.frombuffer(header, dtype='<u4', count=1, offset=80)[0])
+    if size != STL_HEADER_SIZE + STL_FACE_SIZE * num_faces:
+        return None
+
+    return num_faces
+
+
+def weld(corners):
+    """
+       Merge the corners that fall into the same STL_WELD_QUANTUM cell. The quantized
+       coordinates of each corner are viewed as one opaque 24 byte key, so np.unique
+       sorts rows instead of single numbers.
+
+       corners is an (N, 3) array, three consecutive rows per face.
+
+       returns vertices (the first corner of each cell) and faces
+    """
+
+    keys = np.round(corners / STL_WELD_QUANTUM).astype(np.int64)
+    keys = np.ascontiguousarray(keys).view(np.dtype((np.void, keys.dtype.itemsize * 3))).ravel()
+    __, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+    return corners[first].astype(np.float64), inverse.reshape(-1, 3).astype(np.int32)
+
+
+def read_stl(filename):
+    """
+       Read a binary STL file through a memory map and weld the corners of its faces.
+
+       returns vertices, faces arrays
+    """
+
+    num_faces = binary_stl_faces(filename)
+    if num_faces is None:
+        raise ValueError("%s is not a binary STL file" % filename)
+    if num_faces == 0:
+        return np.zeros((0, 3), dtype=np.float64), np.zeros((0, 3), dtype=np.int32)
+
+    data = np.memmap(filename, dtype=STL_FACE_DTYPE, mode='r', offset=STL_HEADER_SIZE, shape=(num_faces,))
+    corners = np.array(data['vertices'], dtype=np.float32).reshape(-1, 3)
+    del data
+
+    return weld(corners)
+
+
+def write_stl(filename, vertices, faces):
+    """
+       Write a binary STL file, the face normals are computed from the vertices.
+    """
+
+    vertices = np.asarray(vertices)
+    faces = np.asarray(faces)
+
+    data = np.zeros(len(faces), dtype=STL_FACE_DTYPE)
+    corners = vertices[faces]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)
+    nonzero = lengths > 0.0
+    normals[nonzero] /= lengths[nonzero][:, np.newaxis]
+    data['normal'] = normals
+    data['vertices'] = corners
+
+    with open(filename, "wb") as f:
+        f.write(STL_HEADER.ljust(80, b" "))
+        f.write(np.array([ len(faces) ], dtype='<u4').tobytes())
+        data.tofile(f)
+
+
+def load_mesh(filename):
+    """
+       Load a mesh, binary STL files are read with read_stl, everything else with pymesh.
+    """
+
+    if binary_stl_faces(filename) is None:
+        return pymesh.meshio.load_mesh(filename)
+
+    return pymesh.form_mesh(*read_stl(filename))
+
+
+def save_mesh(filename, mesh):
+    """
+       Save a mesh, STL files are written with write_stl, everything else with pymesh.
+    """
+
+    if not filename.lower().endswith(".stl"):
+        pymesh.meshio.save_mesh(filename, mesh)
+        return
+
+    write_stl(filename, mesh.vertices, mesh.faces)
+
+
+def stl_chunks(filename, mode='r'):
+    """
+       Map a binary STL file STL_CHUNK_FACES faces at a time, so the memory used stays
+       the same whatever the size of the file. Chunks mapped with mode 'r+' are written
+       back when the next one is mapped.
+
+       yields the face records of each chunk
+    """
+
+    num_faces = binary_stl_faces(filename)
+    if num_faces is None:
+        raise ValueError("%s is not a binary STL file" % filename)
+
+    for start in range(0, num_faces, STL_CHUNK_FACES):
+        count = min(STL_CHUNK_FACES, num_faces - start)
+        data = np.memmap(filename, dtype=STL_FACE_DTYPE, mode=mode, offset=STL_HEADER_SIZE + start * STL_FACE_SIZE,
+                         shape=(count,))
+        yield data
+        if mode != 'r':
+            data.flush()
+        del data
+
+
+def stl_bbox(filename, matrix=None):
+    """
+       returns the bbox of a binary STL file, after applying the 4x4 affine matrix if one
+       is given, in the same format as get_fast_bbox
+    """
+
+    lo = np.full(3, np.inf)
+    hi = np.full(3, -np.inf)
+    for data in stl_chunks(filename):
+        corners = np.asarray(data['vertices'], dtype=np.float64).reshape(-1, 3)
+        if matrix is not None:
+            corners = corners @ matrix[:3, :3].T + matrix[:3, 3]
+        lo = np.minimum(lo, corners.min(axis=0))
+        hi = np.maximum(hi, corners.max(axis=0))
+
+    return [lo.tolist(), hi.tolist()]
+
+
+def transform_stl(filename, matrix):
+    """
+       Apply a 4x4 affine matrix to a binary STL file in place, one chunk at a time.
+       Normals are transformed with the inverse transpose of the linear part. If the
+       matrix mirrors the mesh, two corners of every face are swapped to keep the faces
+       pointing outwards.
+    """
+
+    linear = matrix[:3, :3]
+    normal_matrix = np.linalg.inv(linear).T
+    mirror = np.linalg.det(linear) < 0.0
+
+    for data in stl_chunks(filename, 'r+'):
+        corners = np.asarray(data['vertices'], dtype=np.float64)
+        corners = corners @ linear.T + matrix[:3, 3]
+        if mirror:
+            corners = corners[:, [0, 2, 1]]
+
+        normals = np.asarray(data['normal'], dtype=np.float64) @ normal_matrix.T
+        lengths = np.linalg.norm(normals, axis=1)
+        nonzero = lengths > 0.0
+        normals[nonzero] /= lengths[nonzero][:, np.newaxis]
+
+        data['vertices'] = corners
+        data['normal'] = normals
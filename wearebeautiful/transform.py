@@ -0,0 +1,143 @@
+import math
+import numpy as np
+import pymesh
+from wearebeautiful.utils import get_fast_bbox
+
+# Matrix entries this much smaller than the largest one count as zero, 90 degree
+# rotations leave rounding noise of about 1e-16
+AXIS_ALIGNED_EPS = 1e-9
+
+
+def bbox_corners(bbox):
+    return np.array([(x, y, z) for x in (bbox[0][0], bbox[1][0])
+                               for y in (bbox[0][1], bbox[1][1])
+                               for z in (bbox[0][2], bbox[1][2])], dtype=np.float64)
+
+
+class Transform(object):
+    """
+       Collects rotate/scale/translate steps for a mesh into a single 4x4 affine
+       matrix. The vertices are only touched once, when apply() is called.
+
+       While the transform is axis aligned (rotations by multiples of 90 degrees, which
+       is what we use to place things), intermediate bounding boxes are computed by
+       transforming the 8 corners of the source bbox, which is exact. After any other
+       rotation the corners only give a conservative bbox, so the vertices (or the
+       exact_bbox function, which gets the matrix) are transformed instead. This keeps
+       the rotation pivots the same as with the functions in utils.
+
+       The step methods follow the conventions of the functions in wearebeautiful.utils
+       (including the x/y swap of translate vectors and rotation axes) and return self
+       so that steps can be chained.
+    """
+
+    def __init__(self, mesh, exact_bbox=None):
+        self.mesh = mesh
+        self.matrix = np.identity(4)
+        self.corners = None
+        self.exact_bbox = exact_bbox
+
+
+    @classmethod
+    def from_bbox(cls, bbox, exact_bbox):
+        """
+           Make a transform for a mesh that isn't loaded, only its bbox and the
+           exact_bbox(matrix) function are known. The matrix can be applied with
+           stl.transform_stl, apply() can't be used.
+        """
+        xform = cls(None, exact_bbox)
+        xform.corners = bbox_corners(bbox)
+
+        return xform
+
+
+    def get_corners(self):
+        if self.corners is None:
+            self.corners = bbox_corners(get_fast_bbox(self.mesh))
+
+        return self.corners
+
+
+    def axis_aligned(self):
+        """
+           returns True if the transform maps each axis onto an axis
+        """
+        linear = np.abs(self.matrix[:3, :3])
+        return bool(np.all(np.count_nonzero(linear > AXIS_ALIGNED_EPS * linear.max(), axis=1) == 1))
+
+
+    def bbox(self):
+        """
+           returns the bbox of the transformed mesh in the same format as get_fast_bbox
+        """
+        if not self.axis_aligned():
+            if self.exact_bbox is not None:
+                return self.exact_bbox(self.matrix)
+            if self.mesh is not None:
+                vertices = np.asarray(self.mesh.vertices) @ self.matrix[:3, :3].T + self.matrix[:3, 3]
+                return [vertices.min(axis=0).tolist(), vertices.max(axis=0).tolist()]
+
+        corners = self.get_corners() @ self.matrix[:3, :3].T + self.matrix[:3, 3]
+        return [corners.min(axis=0).tolist(), corners.max(axis=0).tolist()]
+
+
+    def centroid(self):
+        bbox = self.bbox()
+        return 0.5 * (np.array(bbox[0]) + np.array(bbox[1]))
+
+
+    def push(self, matrix):
+        self.matrix = matrix @ self.matrix
+        return self
+
+
+    def rotate(self, offset, rotation_axis, rotation_angle):
+        """
+           offset is a three axis vector
+           rotation_axis is the axis to rotate around
+           angle is the rotation angle in degress
+
+           The rotation happens around the center of the current (exact) bbox, like
+           utils.rotate
+        """
+        axis = np.array((rotation_axis[1], rotation_axis[0], rotation_axis[2]));
+        rot = pymesh.Quaternion.fromAxisAngle(axis, math.radians(rotation_angle)).to_matrix()
+
+        centroid = self.centroid()
+        matrix = np.identity(4)
+        matrix[:3, :3] = rot
+        matrix[:3, 3] = centroid - rot @ centroid + np.array(offset, dtype=np.float64)
+
+        return self.push(matrix)
+
+
+    def scale(self, scale_factor):
+        matrix = np.identity(4)
+        matrix[0, 0], matrix[1, 1], matrix[2, 2] = scale_factor
+
+        return self.push(matrix)
+
+
+    def translate(self, translation_vector):
+        matrix = np.identity(4)
+        matrix[:3, 3] = (translation_vector[1], translation_vector[0], translation_vector[2])
+
+        return self.push(matrix)
+
+
+    def center_around_origin(self):
+        matrix = np.identity(4)
+        matrix[:3, 3] = -self.centroid()
+
+        return self.push(matrix)
+
+
+    def apply(self):
+        """
+           Apply the accumulated transform to the vertex buffer and return the new mesh.
+        """
+        if np.array_equal(self.matrix, np.identity(4)):
+            return self.mesh
+
+        vertices = self.mesh.vertices @ self.matrix[:3, :3].T + self.matrix[:3, 3]
+        return pymesh.form_mesh(vertices, self.mesh.faces, self.mesh.voxels)
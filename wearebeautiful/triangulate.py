@@ -0,0 +1,85 @@
+import numpy as np
+import pymesh
+from scipy.spatial import cKDTree
+
+# Number of polygon edges to test against all points at once in winding_numbers
+WINDING_CHUNK = 256
+
+
+def winding_numbers(points, loops):
+    """
+       points is an (N, 2) array, loops is a list of (M, 2) arrays of closed polygons.
+
+       returns the winding number of each point with respect to all the loops
+    """
+
+    points = np.asarray(points, dtype=np.float64)
+    winding = np.zeros(len(points), dtype=np.int64)
+    x = points[:, 0][:, np.newaxis]
+    y = points[:, 1][:, np.newaxis]
+    for loop in loops:
+        loop = np.asarray(loop, dtype=np.float64)
+        ends = np.roll(loop, -1, axis=0)
+        for i in range(0, len(loop), WINDING_CHUNK):
+            x0, y0 = loop[i:i + WINDING_CHUNK, 0], loop[i:i + WINDING_CHUNK, 1]
+            x1, y1 = ends[i:i + WINDING_CHUNK, 0], ends[i:i + WINDING_CHUNK, 1]
+            left = (x1 - x0) * (y - y0) - (x - x0) * (y1 - y0)
+            up = (y0 <= y) & (y < y1) & (left > 0)
+            down = (y1 <= y) & (y < y0) & (left < 0)
+            winding += up.sum(axis=1) - down.sum(axis=1)
+
+    return winding
+
+
+def triangulate_loops(loops, remove_holes=True):
+    """
+       Constrained triangulation of the area enclosed by a set of closed 2D polygons.
+       No points are added, so the vertices of the result are the loop points in order.
+       Triangle already drops everything outside of the outermost loops. If remove_holes
+       is set, the triangles inside holes are dropped using the non-zero winding rule,
+       which is what fonts use for their outlines.
+
+       loops is a list of (M, 2) arrays, each one a closed polygon without a repeated
+       end point.
+
+       returns points (N, 2) and counter clockwise faces (K, 3)
+    """
+
+    points = np.concatenate([ np.asarray(loop, dtype=np.float64) for loop in loops ])
+    segments = []
+    start = 0
+    for loop in loops:
+        idx = np.arange(start, start + len(loop))
+        segments.append(np.column_stack((idx, np.roll(idx, -1))))
+        start += len(loop)
+    segments = np.concatenate(segments)
+
+    tri = pymesh.triangle()
+    tri.points = points
+    tri.segments = segments
+    tri.split_boundary = False
+    tri.max_num_steiner_points = 0
+    tri.min_angle = 0.0
+    tri.verbosity = 0
+    tri.run()
+    mesh = tri.mesh
+
+    # map the output vertices back onto the input points
+    dist, index = cKDTree(points).query(mesh.vertices[:, :2])
+    if len(dist) and dist.max() > 1e-9 * max(1.0, np.abs(points).max()):
+        raise ValueError("triangulation added points to the polygon")
+    faces = index[mesh.faces]
+
+    a = points[faces[:, 0]]
+    b = points[faces[:, 1]]
+    c = points[faces[:, 2]]
+    area = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (c[:, 0] - a[:, 0]) * (b[:, 1] - a[:, 1])
+    faces = faces[area != 0.0]
+    area = area[area != 0.0]
+    faces[area < 0] = faces[area < 0][:, ::-1]
+
+    if remove_holes:
+        centroids = points[faces].mean(axis=1)
+        faces = faces[winding_numbers(centroids, loops) != 0]
+
+    return points, faces
@@ -2,45 +2,18 @@ import pymesh
 import math
 import os
 import numpy as np
+from wearebeautiful import stl
 
 def get_fast_bbox(mesh):
 
-    bbox = [[100000,100000,100000], [0,0,0]]
-    for vertex in mesh.vertices:
+    vertices = np.asarray(mesh.vertices)
+    return [vertices.min(axis=0).tolist(), vertices.max(axis=0).tolist()]
 
-        if vertex[0] > bbox[1][0]:
-            bbox[1][0] = vertex[0]
-        if vertex[0] < bbox[0][0]:
-            bbox[0][0] = vertex[0]
-
-        if vertex[1] > bbox[1][1]:
-            bbox[1][1] = vertex[1]
-        if vertex[1] < bbox[0][1]:
-            bbox[0][1] = vertex[1]
-
-        if vertex[2] > bbox[1][2]:
-            bbox[1][2] = vertex[2]
-        if vertex[2] < bbox[0][2]:
-            bbox[0][2] = vertex[2]
-
-    return bbox
 
 def get_fast_bbox_2d(points):
 
-    bbox = [[100000,100000], [0,0]]
-    for vertex in points:
-
-        if vertex[0] > bbox[1][0]:
-            bbox[1][0] = vertex[0]
-        if vertex[0] < bbox[0][0]:
-            bbox[0][0] = vertex[0]
-
-        if vertex[1] > bbox[1][1]:
-            bbox[1][1] = vertex[1]
-        if vertex[1] < bbox[0][1]:
-            bbox[0][1] = vertex[1]
-
-    return bbox
+    points = np.asarray(points)[:, :2]
+    return [points.min(axis=0).tolist(), points.max(axis=0).tolist()]
 
 
 def center_around_origin(mesh):
@@ -80,9 +53,9 @@ def rotate(mesh, offset, rotation_axis, rotation_angle):
 
 
 def clear_color(file):
-    mesh = pymesh.meshio.load_mesh(file);
+    mesh = stl.load_mesh(file);
     new_mesh = pymesh.form_mesh(mesh.vertices, mesh.faces)
-    pymesh.meshio.save_mesh(file, new_mesh);
+    stl.save_mesh(file, new_mesh);
 
 
 def scale(mesh, scale_factor):
@@ -93,9 +66,7 @@ def scale(mesh, scale_factor):
        returns rotated mesh
     """
 
-    vertices = []
-    for vertex in mesh.vertices:
-        vertices.append((vertex[0] * scale_factor[0], vertex[1] * scale_factor[1], vertex[2] * scale_factor[2]))
+    vertices = mesh.vertices * np.asarray(scale_factor, dtype=np.float64)
 
     return pymesh.form_mesh(vertices, mesh.faces, mesh.voxels)
 
@@ -108,25 +79,22 @@ def translate(mesh, translation_vector):
        returns rotated mesh
     """
 
-    vertices = []
-    for vertex in mesh.vertices:
-        vertices.append((vertex[0] + translation_vector[1], vertex[1] + translation_vector[0], vertex[2] + translation_vector[2]))
+    # Note: the x and y components of translation_vector are swapped on purpose,
+    # callers rely on this.
+    offset = np.array((translation_vector[1], translation_vector[0], translation_vector[2]), dtype=np.float64)
+    vertices = mesh.vertices + offset
 
     return pymesh.form_mesh(vertices, mesh.faces, mesh.voxels)
 
 
 def flip_mesh(mesh):
-    new_faces = []
-    for face in mesh.faces:
-        new_face = list(face)
-        new_face.reverse()
-        new_faces.append(new_face)
-
-    return pymesh.form_mesh(mesh.vertices, np.array(new_faces))
+    return pymesh.form_mesh(mesh.vertices, np.ascontiguousarray(mesh.faces[:, ::-1]))
 
 
 def make_3d(mesh, offset):
-    vertices = [ (vertex[0], vertex[1], offset) for vertex in mesh.vertices]
+    vertices = np.empty((mesh.num_vertices, 3), dtype=np.float64)
+    vertices[:, :2] = mesh.vertices[:, :2]
+    vertices[:, 2] = offset
     return pymesh.form_mesh(vertices, mesh.faces, mesh.voxels)
 
 
@@ -136,7 +104,7 @@ def save_mesh(filename, mesh):
 
     filename = os.path.join("debug", "%02d-%s.stl" % (file_index, filename))
     file_index += 1
-    pymesh.meshio.save_mesh(filename, mesh)
+    stl.save_mesh(filename, mesh)
     print("wrote %s" % filename)
 
 